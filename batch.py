@@ -0,0 +1,25 @@
+import argparse
+from src.batch_runner import BatchRunner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve one customer network against a directory of forecast scenarios")
+    parser.add_argument("customers", help="customers table, a CSV, Parquet or Feather file")
+    parser.add_argument("forecast_dir", help="directory of forecasted quantity tables, one per scenario")
+    parser.add_argument("--output", default="results.jsonl", help="JSON lines file the results stream to")
+    parser.add_argument("--workers", type=int, help="worker processes, all cores by default")
+    parser.add_argument("--time-limit", type=float, help="ILS time limit per scenario, in seconds")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--cache-dir", help="keep parsed inputs in this directory across runs")
+    args = parser.parse_args()
+
+    runner = BatchRunner.from_directory(args.customers, args.forecast_dir, workers=args.workers,
+                                        time_limit=args.time_limit, seed=args.seed, cache_dir=args.cache_dir)
+
+    def print_result(result):
+        if "error" in result:
+            print(f"{result['scenario']}: failed, {result['error']}")
+        else:
+            print(f"{result['scenario']}: logistic ratio {result['logistic_ratio']}")
+
+    runner.run(args.output, callback=print_result)
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.format_parser import FormatParser
+from src.construction_heuristic import ConstructionHeuristic, IteratedLocalSearch, \
+    or_opt, swap, shift, transfer, perturb_shift, perturb_insertion, perturb_split
+from src.utils.instance_generator import generate_instance
+from src.utils.utility import find_logistic_ratio
+
+
+def measure(func, *args, repeat=1, memory=True):
+    '''
+    Result of func(*args), best wall time over repeat runs and, with memory,
+    the peak traced allocation of one extra run. An untimed first run
+    compiles the numba kernels func reaches, so that JIT time is left out.
+    '''
+    func(*args)
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        wall_times.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        func(*args)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return result, {"wall_time": min(wall_times), "peak_memory": peak_memory}
+
+
+def benchmark_instance(num_customers, duration, seed=0, repeat=1, memory=True, **instance_options):
+    customers_df, forecasted_quantity_df = generate_instance(num_customers, duration, seed=seed, **instance_options)
+    problem = FormatParser(customers_df, forecasted_quantity_df).get_problem()
+    records = []
+
+    def record(stage, name, logistic_ratio, measurement):
+        records.append({"num_customers": num_customers, "duration": duration, "seed": seed,
+                        "stage": stage, "name": name, "logistic_ratio": float(logistic_ratio), **measurement})
+
+    solution, measurement = measure(ConstructionHeuristic(problem).get_solution, repeat=repeat, memory=memory)
+    initial_logistic_ratio, _ = find_logistic_ratio(problem, solution)
+    record("construction", "get_solution", initial_logistic_ratio, measurement)
+
+    for stage, operators in [("local_search", [or_opt, swap, shift, transfer]),
+                             ("perturbation", [perturb_shift, perturb_insertion, perturb_split])]:
+        for operator in operators:
+            (new_problem, new_solution), measurement = measure(operator, problem, solution, repeat=repeat, memory=memory)
+            logistic_ratio, _ = find_logistic_ratio(new_problem, new_solution)
+            record(stage, operator.__name__, logistic_ratio, measurement)
+
+    def execute():
+        return IteratedLocalSearch(problem, initial_solution=solution).execute()
+    (best_problem, best_solution), measurement = measure(execute, repeat=repeat, memory=memory)
+    logistic_ratio, _ = find_logistic_ratio(best_problem, best_solution)
+    record("ils", "execute", logistic_ratio, measurement)
+
+    return records
+
+
+def get_version():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=parent_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time construction, operators and ILS on synthetic instances")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument("--duration", type=int, default=15)
+    parser.add_argument("--night-ratio", type=float, default=0.25)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra traced run for peak memory")
+    parser.add_argument("--output", help="JSON file to write, stdout by default")
+    args = parser.parse_args()
+
+    records = []
+    for num_customers in args.sizes:
+        for seed in args.seeds:
+            records.extend(benchmark_instance(num_customers, args.duration, seed, args.repeat, not args.no_memory,
+                                              night_ratio=args.night_ratio))
+
+    report = {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": records,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.format_parser import FormatParser
+from src.construction_heuristic import ConstructionHeuristic, IteratedLocalSearch
+from src.utils.utility import find_logistic_ratio
+
+
+GSHEET_URL = "https://docs.google.com/spreadsheets/d/1ju4BEDdxhUJj7OvcGG2QmLlbmvSknwlIMFrdUS7JNhk/gviz/tq?tqx=out:csv&sheet={}"
+
+
+def compare_granularities(problem, granularities, repeat=1):
+    '''
+    Logistic ratio and ILS runtime for the exhaustive neighbourhoods (None)
+    and for every candidate list size in granularities
+    '''
+    initial_solution = ConstructionHeuristic(problem).get_solution()
+    results = []
+    for granularity in [None, *granularities]:
+        runtimes = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ils = IteratedLocalSearch(problem.copy(), initial_solution=initial_solution, granularity=granularity)
+            best_problem, best_solution = ils.execute()
+            runtimes.append(time.perf_counter() - start)
+        logistic_ratio, _ = find_logistic_ratio(best_problem, best_solution)
+        results.append((granularity, logistic_ratio, min(runtimes)))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Granular against exhaustive local search neighbourhoods")
+    parser.add_argument("--customers", default=GSHEET_URL.format("customers"))
+    parser.add_argument("--forecast", default=GSHEET_URL.format("forecasted_quantity"))
+    parser.add_argument("-k", type=int, nargs="+", default=[2, 3, 5, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    problem = FormatParser(pd.read_csv(args.customers), pd.read_csv(args.forecast)).get_problem()
+    results = compare_granularities(problem, args.k, args.repeat)
+
+    exhaustive_runtime = results[0][2]
+    print(f"{'k':>10} {'logistic ratio':>16} {'runtime (s)':>12} {'speedup':>8}")
+    for granularity, logistic_ratio, runtime in results:
+        label = "exhaustive" if granularity is None else granularity
+        print(f"{label:>10} {logistic_ratio:>16.4f} {runtime:>12.4f} {exhaustive_runtime/runtime:>8.2f}")
@@ -1,25 +1,53 @@
-import pandas as pd
+import os
+import argparse
 from src.format_parser import FormatParser
-from src.construction_heuristic import IteratedLocalSearch
+from src.problem_cache import ProblemCache
+from src.solution_writer import write_solution
+from src.construction_heuristic import IteratedLocalSearch, CONSTRUCTION_STRATEGIES
 from src.utils.utility import find_logistic_ratio
 
 
+# https://docs.google.com/spreadsheets/d/1ju4BEDdxhUJj7OvcGG2QmLlbmvSknwlIMFrdUS7JNhk/edit#gid=1442154428
+GSHEET_URL = "https://docs.google.com/spreadsheets/d/1ju4BEDdxhUJj7OvcGG2QmLlbmvSknwlIMFrdUS7JNhk/gviz/tq?tqx=out:csv&sheet={}"
+
+
 if __name__ == '__main__':
-    # https://docs.google.com/spreadsheets/d/1ju4BEDdxhUJj7OvcGG2QmLlbmvSknwlIMFrdUS7JNhk/edit#gid=1442154428
-    gsheetid = '1ju4BEDdxhUJj7OvcGG2QmLlbmvSknwlIMFrdUS7JNhk'
-    forecasted_quantity_sheet = 'forecasted_quantity'
-    customers_sheet = 'customers'
-    forecasted_quantity_sheet_url = "https://docs.google.com/spreadsheets/d/{}/gviz/tq?tqx=out:csv&sheet={}".format(gsheetid, forecasted_quantity_sheet)
-    customers_sheet_url = "https://docs.google.com/spreadsheets/d/{}/gviz/tq?tqx=out:csv&sheet={}".format(gsheetid, customers_sheet)
-
-    customers_df = pd.read_csv(customers_sheet_url)
-    forecasted_quantity_df = pd.read_csv(forecasted_quantity_sheet_url)
-    
-    raw_problem = FormatParser(customers_df, forecasted_quantity_df).get_problem()
-    problem, solution = IteratedLocalSearch(raw_problem).execute()
+    parser = argparse.ArgumentParser(description="Iterated local search for the inventory routing problem")
+    parser.add_argument("--customers", default=GSHEET_URL.format("customers"),
+                        help="customers table, a CSV file or URL, a Parquet or a Feather file")
+    parser.add_argument("--forecast", default=GSHEET_URL.format("forecasted_quantity"),
+                        help="forecasted quantity table, in the same formats")
+    parser.add_argument("--cache-dir", help="cache parsed local inputs in this directory")
+    parser.add_argument("--construction", choices=CONSTRUCTION_STRATEGIES, default="sequential",
+                        help="route builder of the initial solution")
+    parser.add_argument("--adaptive", action="store_true", help="pick operators with adaptive weights")
+    parser.add_argument("--reoptimize-quantities", action="store_true",
+                        help="raise the delivery quantities of every local optimum within vehicle and tank capacity")
+    parser.add_argument("--time-limit", type=float, help="ILS time limit in seconds")
+    parser.add_argument("--patience", type=int, default=1, help="ILS steps in a row without improvement before stopping")
+    parser.add_argument("--output-jsonl", help="write the routes of the best solution to this JSON lines file")
+    parser.add_argument("--output-dir", help="write the routes of the best solution to this directory in the columnar "
+                                             "format of src.solution_writer")
+    args = parser.parse_args()
+
+    def print_step(problem, solution, logistic_ratio):
+        print("ILS step")
+        print(solution)
+
+    # remote inputs have no stable content to key the cache on
+    if args.cache_dir is not None and os.path.isfile(args.customers) and os.path.isfile(args.forecast):
+        raw_problem = ProblemCache(args.cache_dir).load_problem(args.customers, args.forecast)
+    else:
+        raw_problem = FormatParser.from_files(args.customers, args.forecast).get_problem()
+    ils = IteratedLocalSearch(raw_problem, construction_strategy=args.construction, adaptive=args.adaptive,
+                              quantity_reoptimization=args.reoptimize_quantities)
+    problem, solution = ils.execute(args.time_limit, patience=args.patience, callback=print_step)
 
     logistic_ratio, [setup_cost, delivery_cost, delivered_quantity_list, distance_list] = find_logistic_ratio(problem, solution)
 
+    if args.output_jsonl is not None or args.output_dir is not None:
+        write_solution(solution, args.output_jsonl, args.output_dir)
+
     print("Best solution:\n", solution)
     print("Logistic ratio: ", logistic_ratio)
     print("Dilivery quantities:\n", problem.dilivery_quantities)
@@ -28,3 +56,5 @@ if __name__ == '__main__':
     print("Travelling cost: ", delivery_cost)
     print("Total transportation quantity [day, night]: ", delivered_quantity_list)
     print("Total transportation distance [day, night]: ", distance_list)
+    if args.adaptive:
+        print("Operator weights: ", ils.get_operator_weights())
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.problem_cache import ProblemCache
+from src.construction_heuristic import IteratedLocalSearch
+from src.parallel import get_worker_count
+from src.utils.utility import find_logistic_ratio
+
+FORECAST_EXTENSIONS = (".csv", ".parquet", ".pq", ".feather", ".arrow")
+
+
+def find_scenarios(forecast_dir):
+    '''
+    Forecast files of forecast_dir, in name order
+    '''
+    return [os.path.join(forecast_dir, name) for name in sorted(os.listdir(forecast_dir))
+            if os.path.splitext(name)[1].lower() in FORECAST_EXTENSIONS]
+
+
+def to_builtin(value):
+    '''
+    Nested lists of NumPy scalars as plain Python numbers, for JSON
+    '''
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def solve_scenario(cache_dir, customers_path, forecasted_quantity_path, time_limit=None, seed=None):
+    '''
+    Best ILS solution of one forecast scenario, summarised as a JSON-ready dict
+    '''
+    started_at = time.time()
+    problem = ProblemCache(cache_dir).load_problem(customers_path, forecasted_quantity_path)
+    problem, solution = IteratedLocalSearch(problem, seed=seed).execute(time_limit)
+    logistic_ratio, [setup_cost, delivery_cost, delivered_quantity_list, distance_list] = find_logistic_ratio(problem, solution)
+
+    return {
+        "scenario": os.path.basename(forecasted_quantity_path),
+        "logistic_ratio": float(logistic_ratio),
+        "setup_cost": float(setup_cost),
+        "delivery_cost": float(delivery_cost),
+        "delivered_quantity_list": to_builtin(delivered_quantity_list),
+        "distance_list": to_builtin(distance_list),
+        "routes": problem.print_canonical(solution),
+        "wall_time": time.time() - started_at,
+    }
+
+
+class BatchRunner:
+    '''
+    Solve one customer network against many forecast scenarios in a
+    process pool. The customers are parsed and their distance matrix built
+    once, into a ProblemCache the workers memory-map from; without a
+    cache_dir a temporary one lives for the duration of the run.
+    '''
+    def __init__(self, customers_path, forecast_paths, workers=None, time_limit=None, seed=None, cache_dir=None):
+        self.customers_path = customers_path
+        self.forecast_paths = list(forecast_paths)
+        self.workers = get_worker_count(workers)
+        self.time_limit = time_limit
+        self.seed = seed
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def from_directory(cls, customers_path, forecast_dir, **kwargs):
+        return cls(customers_path, find_scenarios(forecast_dir), **kwargs)
+
+    def iter_results(self):
+        '''
+        Yield the result of every scenario as soon as it finishes, a
+        scenario that fails yields its error instead
+        '''
+        if not self.forecast_paths:
+            return
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = self.cache_dir if self.cache_dir is not None else temp_dir
+            # warm the cache so that the workers find the customers and the distance matrix ready
+            ProblemCache(cache_dir).get_distance_matrix(self.customers_path)
+
+            with ProcessPoolExecutor(self.workers) as executor:
+                futures = {executor.submit(solve_scenario, cache_dir, self.customers_path, path, self.time_limit, self.seed): path
+                           for path in self.forecast_paths}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        result = {"scenario": os.path.basename(futures[future]), "error": repr(error)}
+                    yield result
+
+    def run(self, output_path, callback=None):
+        '''
+        Stream every result to output_path as one JSON line and return them,
+        callback(result) sees each one as it is written
+        '''
+        results = []
+        with open(output_path, "w") as f:
+            for result in self.iter_results():
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+        return results
@@ -1,90 +1,239 @@
 import os
 import sys
-import copy
+import time
+import random
+import functools
 import itertools
 from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
 from src.structure import Problem, Route
-from src.utils.utility import find_inventory_levels, check_urgency_degree, nearest_neighbor_insertion_heuristic, find_logistic_ratio
+from src.solution_state import SolutionState, copy_solution
+from src.parallel import SharedArrays, attach_shared_arrays, get_worker_count
+from src.instrumentation import get_instrumentation
+from src.period_parallel import PeriodParallelExecutor
+from src.operator_scheduler import AdaptiveOperatorScheduler
+from src.quantity_optimization import reoptimize_quantities
+from src.evaluation_cache import EvaluationCache, DEFAULT_MAX_BYTES, evaluate_solution, state_fingerprint
+from src.spatial_index import SpatialIndex, SPATIAL_INDEX_MIN_CUSTOMERS
+from src.utils.utility import simulate_inventory, update_inventory_levels, check_urgency_degree, \
+    nearest_neighbor_insertion_heuristic, savings_heuristic, sweep_heuristic, SAVINGS_NEIGHBOURS, find_routes_logistic_ratio, get_route_distance, get_route_quantity
+from src.utils.move_evaluation import MoveDelta, delta_relocate, delta_cross_exchange, \
+    is_granular_relocate, is_granular_cross_exchange, \
+    get_candidate_matrix, batch_or_opt_numbers, batch_relocate, batch_cross_exchange
+
+# Most random moves of the kick of a seeded perturbation step
+KICK_MOVES = 8
+# Route builders of construct_solution: customers in list order, Clarke-Wright savings or angular sweep
+CONSTRUCTION_STRATEGIES = ("sequential", "savings", "sweep")
+
+
+def build_routes(strategy, arrays, customers, t_dilivery_quantities, vehicle_capacity):
+    '''
+    Split the customer numbers serviced in one period and time window into routes
+    '''
+    if strategy == "savings":
+        nearest = None
+        if len(customers) >= SPATIAL_INDEX_MIN_CUSTOMERS:
+            rows = np.asarray(customers) - 1
+            index = SpatialIndex(customers, arrays["latitudes"][rows], arrays["longitudes"][rows], np.zeros(len(rows)))
+            nearest = index.find_nearest(SAVINGS_NEIGHBOURS, same_time_window=False)
+        return savings_heuristic(customers, t_dilivery_quantities, vehicle_capacity, arrays["distance_matrix"], nearest=nearest)
+    if strategy == "sweep":
+        return sweep_heuristic(customers, t_dilivery_quantities, vehicle_capacity, arrays["angles"])
+    return nearest_neighbor_insertion_heuristic(customers, t_dilivery_quantities, vehicle_capacity)
+
+
+def construct_solution(arrays, vehicle_capacity, ratio_demand, look_ahead, fixed_routes=None, strategy="sequential"):
+    '''
+    Deliveries and routes for one (ratio_demand, look_ahead) setting, built
+    from the arrays of Problem.get_arrays. Routes are lists of customer numbers,
+    strategy picks the route builder, see CONSTRUCTION_STRATEGIES.
 
-class ConstructionHeuristic:
-    def __init__(self, problem: Problem):
-        self.problem: Problem = problem
+    With fixed_routes, the routes of the first len(fixed_routes) periods,
+    those periods and their deliveries (arrays["dilivery_quantities"]) are
+    kept and only the following ones are built.
+    '''
+    numbers = arrays["numbers"]
+    capacities = arrays["capacities"]
+    safety_levels = arrays["safety_levels"]
+    is_night = arrays["is_night"]
+    forecasted_quantities = arrays["forecasted_quantities"]
+    init_quantities = arrays["init_quantities"]
+    scaling_factors = 100 / capacities
+    duration = forecasted_quantities.shape[1]
+
+    def get_appropriate_quantities(t, inventory_levels):
+        '''
+        Customers serviced on day t and their dilivery quantities
+        '''
+        levels_condition = inventory_levels[:, t] - safety_levels
+        current_inventory_value = inventory_levels[:, max(t-1, 0)]
+        is_below_safety = levels_condition < 0
+        is_urgent = ~is_below_safety & check_urgency_degree(inventory_levels, safety_levels, t, look_ahead)
+
+        if t == (duration-1):
+            below_safety_quantities = np.minimum(-levels_condition/100*capacities, vehicle_capacity)
+        else:
+            below_safety_quantities = np.minimum(capacities*(1 - current_inventory_value/100), vehicle_capacity)
+        urgent_quantities = np.minimum((capacities*(1 - current_inventory_value/100))*ratio_demand, vehicle_capacity)
+
+        dilivery_quantities = np.where(is_below_safety, below_safety_quantities, np.where(is_urgent, urgent_quantities, 0))
+        return is_below_safety | is_urgent, dilivery_quantities
+
+    dilivery_quantities = np.zeros_like(forecasted_quantities)
+    solution = []
+    if fixed_routes:
+        dilivery_quantities[:, :len(fixed_routes)] = arrays["dilivery_quantities"][:, :len(fixed_routes)]
+        solution = [list(routes) for routes in fixed_routes]
+    running_levels = simulate_inventory(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities)
+    inventory_levels = np.zeros_like(forecasted_quantities)
+    inventory_levels[:] = np.round(running_levels)
+    for t in range(len(solution), duration):
+        is_serviced, dilivery_quantities[:, t] = get_appropriate_quantities(t, inventory_levels)
+        C_day = numbers[is_serviced & ~is_night].tolist()
+        C_night = numbers[is_serviced & is_night].tolist()
+
+        t_dilivery_quantities = tuple(dilivery_quantities[:, t])
+        routes_day = build_routes(strategy, arrays, C_day, t_dilivery_quantities, vehicle_capacity)
+        routes_night = build_routes(strategy, arrays, C_night, t_dilivery_quantities, vehicle_capacity)
+        solution.append([*routes_day, *routes_night])
+
+        # only the levels from day t onward depend on today's deliveries
+        update_inventory_levels(inventory_levels, running_levels, init_quantities, scaling_factors,
+                                forecasted_quantities, dilivery_quantities, t)
+
+    return dilivery_quantities, solution
+
+
+def evaluate_construction(arrays, costs, ratio_demand, look_ahead, fixed_routes=None, strategy="sequential"):
+    '''
+    Logistic ratio, deliveries and routes of construct_solution, costs is
+    (vehicle_capacity, setup_cost_for_one_trip, delivery_unit_cost)
+    '''
+    dilivery_quantities, solution = construct_solution(arrays, costs[0], ratio_demand, look_ahead, fixed_routes, strategy)
 
-    def get_solution(self):
-        """Solution sampled from customer list, sorted by demand"""
+    delivered_quantity_list, distance_list = [], []
+    for t, routes in enumerate(solution):
+        t_dilivery_quantities = tuple(dilivery_quantities[:, t])
+        delivered_quantity_list.append([get_route_quantity(t_dilivery_quantities, route) for route in routes])
+        distance_list.append([get_route_distance(arrays["distance_matrix"], route) for route in routes])
+    logistic_ratio, _ = find_routes_logistic_ratio(delivered_quantity_list, distance_list, *costs)
 
-        def get_appropriate_route(ratio_demand, look_ahead, t, i, inventory_levels, customer, customers_in_route):
-            dilivery_quantity = 0
-            levels_condition = inventory_levels[i][t] - customer.safety_level
-            if t == 0: current_inventory_value = inventory_levels[i][0]
-            else: current_inventory_value = inventory_levels[i][t-1]
-            if levels_condition < 0:
-                if t == (self.problem.duration-1):
-                    dilivery_quantity = min(-levels_condition/100*customer.capacity, self.problem.vehicle_capacity)
-                else:
-                    dilivery_quantity = min(customer.capacity*(1 - current_inventory_value/100), self.problem.vehicle_capacity)
-                customers_in_route.append(customer)
-            else:
-                if check_urgency_degree(customer, inventory_levels, t, i, look_ahead):
-                    dilivery_quantity = min((customer.capacity*(1 - current_inventory_value/100))*ratio_demand, self.problem.vehicle_capacity)
-                    customers_in_route.append(customer)
-            return customers_in_route, dilivery_quantity
+    return logistic_ratio, dilivery_quantities, solution
 
 
-        logistic_ratio_min = 1000000000
+# Problem arrays of a construction worker process, see _init_construction_worker
+_worker_arrays = None
+_worker_costs = None
+_worker_fixed_routes = None
+_worker_strategy = "sequential"
+
+
+def _init_construction_worker(descriptors, costs, fixed_routes=None, strategy="sequential"):
+    global _worker_arrays, _worker_costs, _worker_fixed_routes, _worker_strategy
+    _worker_arrays = attach_shared_arrays(descriptors)
+    _worker_costs = costs
+    _worker_fixed_routes = fixed_routes
+    _worker_strategy = strategy
+
+
+def _evaluate_construction_in_worker(parameters):
+    return evaluate_construction(_worker_arrays, _worker_costs, *parameters, _worker_fixed_routes, _worker_strategy)
+
+
+class ConstructionHeuristic:
+    def __init__(self, problem: Problem, workers=1, initial_solution=None, start=0, strategy="sequential"):
+        '''
+        With an initial_solution and a start day, the periods before start
+        keep its routes and the problem's deliveries, only the rest is built.
+        strategy is the route builder, one of CONSTRUCTION_STRATEGIES.
+        '''
+        if strategy not in CONSTRUCTION_STRATEGIES:
+            raise ValueError(f"unknown construction strategy {strategy!r}, expected one of {CONSTRUCTION_STRATEGIES}")
+        self.problem: Problem = problem
+        self.workers = workers
+        self.initial_solution = initial_solution
+        self.start = start if initial_solution is not None else 0
+        self.strategy = strategy
+
+    def get_parameters(self):
+        '''
+        Every (ratio_demand, look_ahead) setting tried by get_solution
+        '''
+        parameters = []
         ratio_demand = 1.0
         while ratio_demand > 0:
             look_ahead = 1
             while look_ahead <= (self.problem.duration/2):
-                dilivery_quantities = np.zeros_like(self.problem.forecasted_quantities)
-                inventory_levels = find_inventory_levels(self.problem.customers,
-                                                         self.problem.forecasted_quantities,
-                                                         dilivery_quantities)
-                solution = []
-                for t in range(self.problem.duration):
-                    C_day = []
-                    C_night = []
-                    for i, customer in enumerate(self.problem.customers):
-                        dilivery_quantity = 0
-                        if customer.time_window == 'night':
-                            C_night, dilivery_quantity = get_appropriate_route(ratio_demand, look_ahead, t, i, inventory_levels, customer, C_night)
-                        else:
-                            C_day, dilivery_quantity = get_appropriate_route(ratio_demand, look_ahead, t, i, inventory_levels, customer, C_day)
-
-                        dilivery_quantities[i][t] = dilivery_quantity
-
-                    t_dilivery_quantities = list(zip(*dilivery_quantities))[t]
-
-                    routes = []
-                    routes_day = nearest_neighbor_insertion_heuristic(C_day, t_dilivery_quantities, self.problem.vehicle_capacity)
-                    routes_night = nearest_neighbor_insertion_heuristic(C_night, t_dilivery_quantities, self.problem.vehicle_capacity)
-
-                    for route in [*routes_day, *routes_night]:
-                        routes.append(Route(self.problem, route, t_dilivery_quantities))
-
-                    solution.append(routes)
-                    
-                    # update inventory levels
-                    inventory_levels = find_inventory_levels(self.problem.customers,
-                                                             self.problem.forecasted_quantities,
-                                                             dilivery_quantities)
-
-                logistic_ratio, _ = find_logistic_ratio(self.problem, solution)
-                if logistic_ratio < logistic_ratio_min:
-                    logistic_ratio_min = logistic_ratio
-                    best_solution = solution
-                    self.problem.dilivery_quantities = dilivery_quantities
-
+                parameters.append((ratio_demand, look_ahead))
                 look_ahead += 1
             ratio_demand = round(ratio_demand - 0.1, 1)
+        return parameters
+
+    def get_solution(self):
+        """Solution sampled from customer list, sorted by demand"""
+        arrays = self.problem.get_arrays()
+        costs = (self.problem.vehicle_capacity, self.problem.setup_cost_for_one_trip, self.problem.delivery_unit_cost)
+        parameters = self.get_parameters()
+        workers = get_worker_count(self.workers)
+        fixed_routes = None
+        if self.start > 0:
+            arrays["dilivery_quantities"] = self.problem.dilivery_quantities
+            fixed_routes = [[route.numbers[1:-1] for route in routes] for routes in self.initial_solution[:self.start]]
+
+        if workers == 1:
+            best = self.reduce(evaluate_construction(arrays, costs, *p, fixed_routes, self.strategy) for p in parameters)
+        else:
+            chunksize = max(1, len(parameters) // (4*workers))
+            with SharedArrays(arrays) as shared_arrays, \
+                 ProcessPoolExecutor(workers, initializer=_init_construction_worker,
+                                     initargs=(shared_arrays.descriptors, costs, fixed_routes, self.strategy)) as executor:
+                best = self.reduce(executor.map(_evaluate_construction_in_worker, parameters, chunksize=chunksize))
+
+        _, dilivery_quantities, routes = best
+        self.problem.dilivery_quantities = dilivery_quantities
+        customers = {customer.number: customer for customer in self.problem.customers}
+        # the fixed periods keep their route objects as they are
+        best_solution = [list(routes) for routes in self.initial_solution[:self.start]] if self.start > 0 else []
+        for t, t_routes in enumerate(routes[self.start:], self.start):
+            t_dilivery_quantities = tuple(dilivery_quantities[:, t])
+            best_solution.append([Route(self.problem, [customers[number] for number in route], t_dilivery_quantities)
+                                  for route in t_routes])
 
         return best_solution
 
+    @staticmethod
+    def reduce(results):
+        '''
+        First result with the lowest logistic ratio, in parameter order
+        '''
+        logistic_ratio_min = 1000000000
+        best = None
+        for result in results:
+            if result[0] < logistic_ratio_min:
+                logistic_ratio_min = result[0]
+                best = result
+        return best
+
+
+def get_periods(solution, periods=None):
+    '''
+    Periods an operator works on, all of them by default
+    '''
+    return range(len(solution)) if periods is None else periods
+
+
+def is_transfer_period(t, duration, periods=None):
+    '''
+    Whether customers serviced in period t may move to the periods around it
+    '''
+    return 0 < t < duration-1 and (periods is None or (t-1 in periods and t+1 in periods))
+
 
 def raw_or_opt(a, i, j):
     if i == 0:
@@ -92,26 +241,58 @@ def raw_or_opt(a, i, j):
     return a[:i] + a[j:i - 1:-1] + a[j+1:]
 
 
-def or_opt(problem, solution):
+# Skipped move of a granular neighbourhood, never feasible nor improving
+NON_CANDIDATE_MOVE = MoveDelta(0, 0, 0, False)
+
+# Moves between two routes from which one batch kernel call beats scalar deltas
+BATCH_MIN_MOVES = 48
+
+
+def get_route_candidate_matrix(route, candidate_lists):
+    if candidate_lists is None:
+        return None
+    return get_candidate_matrix(candidate_lists, len(route.problem.distance_matrix))
+
+
+def or_opt(problem, solution, candidate_lists=None, periods=None):
     '''
-    transfers k adjacent customers from their current 
-    position to another position in the same route
+    reverses segments of a route (2-opt): all the reversals of
+    a route are scored at once and the best improving one is
+    applied, until none improves
     '''
-    new_problem = copy.deepcopy(problem)
-    new_solution = copy.deepcopy(solution)
-    for t in range(len(new_solution)):
-        t_dilivery_quantities = list(zip(*new_problem.dilivery_quantities))[t]
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    distance_matrix = new_problem.distance_matrix
+    candidate_matrix = None if candidate_lists is None else get_candidate_matrix(candidate_lists, len(distance_matrix))
+    candidates, accepted = 0, 0
+    for t in get_periods(new_solution, periods):
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
         for i, route in enumerate(new_solution[t]):
-            is_stucked = False
-            while not is_stucked:
-                is_stucked = True
-                for k, l in itertools.combinations(range(len(route.customers)), 2):
-                    new_route = Route(new_problem, raw_or_opt(route.customers, k, l), t_dilivery_quantities)
-                    if new_route.is_feasible:
-                        if new_route.total_distance < new_solution[t][i].total_distance:
-                            new_solution[t][i] = new_route
-                            is_stucked = False
+            # a reversal keeps the customers of the route, hence its feasibility
+            m = len(route.customers)
+            if m < 2 or not route.is_feasible:
+                continue
+
+            numbers = route.index_array.copy()
+            order = np.arange(m)
+            moves = 0
+            # bounded so that rounding in the deltas cannot cycle
+            for _ in range(m*m):
+                deltas = batch_or_opt_numbers(distance_matrix, numbers, candidate_matrix)
+                candidates += int(np.isfinite(deltas).sum())
+                best = int(np.argmin(deltas))
+                if not deltas.flat[best] < 0:
+                    break
+                k, l = divmod(best, m)
+                numbers[k+1:l+2] = numbers[k+1:l+2][::-1]
+                order[k:l+1] = order[k:l+1][::-1]
+                moves += 1
+
+            if moves:
+                accepted += moves
+                new_solution[t][i] = route.with_order(order, t_dilivery_quantities)
 
+    get_instrumentation().record_moves("or_opt", candidates, accepted)
     return new_problem, new_solution
 
 
@@ -133,35 +314,119 @@ def raw_swap(a, b, i, j, num_customer_swap=1):
     return a, b
 
 
-def swap(problem, solution):
-    new_problem = copy.deepcopy(problem)
-    new_solution = copy.deepcopy(solution)
-    for t in range(len(new_solution)):
-        t_dilivery_quantities = list(zip(*new_problem.dilivery_quantities))[t]
+def evaluate_swap(route_a, route_b, i, j, num_customer_swap=1, candidate_lists=None):
+    '''
+    Move delta of raw_swap without building the new routes, None when
+    raw_swap has no move for (i, j)
+    '''
+    a, b = route_a.customers, route_b.customers
+    if len(a) < num_customer_swap or len(b) < num_customer_swap:
+        return None
+    if len(b[j:j+num_customer_swap]) == num_customer_swap:
+        if candidate_lists is not None and not is_granular_cross_exchange(candidate_lists, route_a, route_b, i, j, 1, num_customer_swap):
+            return NON_CANDIDATE_MOVE
+        return delta_cross_exchange(route_a, route_b, i, j, 1, num_customer_swap)
+    if len(b) <= 2:
+        return None
+
+    # customers taken from both ends of b, no constant-time delta for that
+    c1, c2 = raw_swap(a, b, i, j, num_customer_swap)
+    r1, r2 = route_a.with_customers(c1), route_b.with_customers(c2)
+    distance = r1.total_distance + r2.total_distance - route_a.total_distance - route_b.total_distance
+    return MoveDelta(distance, r1.total_quantity - route_a.total_quantity,
+                     r2.total_quantity - route_b.total_quantity, r1.is_feasible and r2.is_feasible)
+
+
+def find_swap(route_a, route_b, k=0, l=0, num_customer_swap=1, candidate_lists=None):
+    '''
+    First improving feasible move (k, l, num_customer_swap) of the swap scan
+    over route_a and route_b, starting from the given one, and the number of
+    moves evaluated. The scan goes over k, then l, then num_customer_swap.
+    '''
+    len_a, len_b = len(route_a.customers), len(route_b.customers)
+    if 2*len_a*len_b >= BATCH_MIN_MOVES:
+        return find_swap_batch(route_a, route_b, k, l, num_customer_swap, candidate_lists)
+
+    candidates = 0
+    for position in range(k*len_b + l, len_a*len_b):
+        k, l = divmod(position, len_b)
+        for n in range(num_customer_swap, 3):
+            delta = evaluate_swap(route_a, route_b, k, l, n, candidate_lists)
+            if delta is None:
+                break
+            candidates += 1
+            if delta.is_feasible and delta.distance < 0:
+                return (k, l, n), candidates
+        num_customer_swap = 1
+    return None, candidates
+
+
+def find_swap_batch(route_a, route_b, k=0, l=0, num_customer_swap=1, candidate_lists=None):
+    '''
+    find_swap with every move scored by the batch kernels
+    '''
+    len_a, len_b = len(route_a.customers), len(route_b.customers)
+    candidate_matrix = get_route_candidate_matrix(route_a, candidate_lists)
+    is_improving = np.zeros((len_a, len_b, 2), dtype=bool)
+    deltas, is_feasible = batch_cross_exchange(route_a, route_b, 1, 1, candidate_matrix)
+    is_improving[:, :, 0] = is_feasible & (deltas < 0)
+    has_pairs = len_a >= 2 and len_b >= 2
+    if has_pairs:
+        deltas, is_feasible = batch_cross_exchange(route_a, route_b, 1, 2, candidate_matrix)
+        is_improving[:, :len_b-1, 1] = is_feasible & (deltas < 0)
+
+    start = (k*len_b + l)*2 + num_customer_swap - 1
+    hits = np.flatnonzero(is_improving.ravel()[start:])
+    end = start + int(hits[0]) if len(hits) else is_improving.size
+
+    # two customers from the last position of b wrap around to its first one, scored one by one
+    if has_pairs and len_b > 2:
+        for k in range(len_a):
+            position = (k*len_b + len_b - 1)*2 + 1
+            if position >= end:
+                break
+            if position < start:
+                continue
+            delta = evaluate_swap(route_a, route_b, k, len_b - 1, 2, candidate_lists)
+            if delta.is_feasible and delta.distance < 0:
+                end = position
+                break
+
+    if end == is_improving.size:
+        return None, end - start
+    k, rest = divmod(end, 2*len_b)
+    l, n = divmod(rest, 2)
+    return (k, l, n+1), end - start + 1
+
+
+def swap(problem, solution, candidate_lists=None, periods=None):
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    candidates, accepted = 0, 0
+    for t in get_periods(new_solution, periods):
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
         is_stucked = False
         while not is_stucked:
             is_stucked = True
             for i, j in itertools.combinations(range(len(new_solution[t])), 2):
-                for k, l in itertools.product(range(len(new_solution[t][i].customers)), range(len(new_solution[t][j].customers))):
-                    is_break = False
-                    for num_customer_swap in [1,2]:
-                        c1, c2 = raw_swap(new_solution[t][i].customers, new_solution[t][j].customers, k, l, num_customer_swap)
-
-                        if c1 is None:
-                            break
-
-                        r1, r2 = Route(new_problem, c1, t_dilivery_quantities), Route(new_problem, c2, t_dilivery_quantities)
-                        if r1.is_feasible and r2.is_feasible:
-                            if r1.total_distance + r2.total_distance < new_solution[t][i].total_distance + new_solution[t][j].total_distance:
-                                new_solution[t][i] = r1
-                                new_solution[t][j] = r2
-                                is_stucked = False
-                                if num_customer_swap == 2:
-                                    is_break = True
-                                    break
-                    if is_break:
+                # after a one-customer swap the scan goes on from the same position
+                move = (0, 0, 1)
+                while move is not None:
+                    route_a, route_b = new_solution[t][i], new_solution[t][j]
+                    move, evaluated = find_swap(route_a, route_b, *move, candidate_lists)
+                    candidates += evaluated
+                    if move is None:
                         break
 
+                    k, l, num_customer_swap = move
+                    accepted += 1
+                    c1, c2 = raw_swap(route_a.customers, route_b.customers, k, l, num_customer_swap)
+                    new_solution[t][i] = Route(new_problem, c1, t_dilivery_quantities)
+                    new_solution[t][j] = Route(new_problem, c2, t_dilivery_quantities)
+                    is_stucked = False
+                    move = (k, l, 2) if num_customer_swap == 1 else None
+
+    get_instrumentation().record_moves("swap", candidates, accepted)
     return new_problem, new_solution
 
 
@@ -179,65 +444,128 @@ def raw_shift(a, b, i, j=1):
     return a, b
 
 
-def shift(problem, solution):
-    new_problem = copy.deepcopy(problem)
-    new_solution = copy.deepcopy(solution)
-    for t in range(len(new_solution)):
-        t_dilivery_quantities = list(zip(*new_problem.dilivery_quantities))[t]
+def evaluate_shift(route_a, route_b, i, j=1, candidate_lists=None):
+    '''
+    Move delta of raw_shift without building the new routes, None when
+    raw_shift has no move for (i, j)
+    '''
+    source, target = route_b, route_a
+    if len(route_b.customers) - 1 - i < 0:
+        i = i - len(route_b.customers)
+        source, target = route_a, route_b
+
+    if i+j > len(source.customers):
+        return None
+
+    if candidate_lists is not None and not is_granular_relocate(candidate_lists, source, target, i, j):
+        return NON_CANDIDATE_MOVE
+    return delta_relocate(source, target, i, j)
+
+
+def find_shift(route_a, route_b, k=0, l=1, candidate_lists=None):
+    '''
+    First improving feasible move (k, l) of the shift scan over route_a and
+    route_b, starting from the given one, and the number of moves evaluated
+    '''
+    len_a, len_b = len(route_a.customers), len(route_b.customers)
+    if 3*(len_a + len_b) >= BATCH_MIN_MOVES:
+        return find_shift_batch(route_a, route_b, k, l, candidate_lists)
+
+    candidates = 0
+    for k in range(k, len_a + len_b):
+        for n in range(l, 4):
+            delta = evaluate_shift(route_a, route_b, k, n, candidate_lists)
+            if delta is None:
+                break
+            candidates += 1
+            if delta.is_feasible and delta.distance < 0:
+                return (k, n), candidates
+        l = 1
+    return None, candidates
+
+
+def find_shift_batch(route_a, route_b, k=0, l=1, candidate_lists=None):
+    '''
+    find_shift with every move scored by the batch kernels
+    '''
+    len_a, len_b = len(route_a.customers), len(route_b.customers)
+    candidate_matrix = get_route_candidate_matrix(route_a, candidate_lists)
+    is_improving = np.zeros((len_a + len_b, 3), dtype=bool)
+    for n in range(1, 4):
+        # the first len_b positions move customers of route_b, the others customers of route_a
+        deltas, is_feasible = batch_relocate(route_b, route_a, n, candidate_matrix)
+        is_improving[:len(deltas), n-1] = is_feasible & (deltas < 0)
+        deltas, is_feasible = batch_relocate(route_a, route_b, n, candidate_matrix)
+        is_improving[len_b:len_b+len(deltas), n-1] = is_feasible & (deltas < 0)
+
+    start = k*3 + l - 1
+    hits = np.flatnonzero(is_improving.ravel()[start:])
+    if not len(hits):
+        return None, is_improving.size - start
+    k, n = divmod(start + int(hits[0]), 3)
+    return (k, n+1), int(hits[0]) + 1
+
+
+def shift(problem, solution, candidate_lists=None, periods=None):
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    candidates, accepted = 0, 0
+    for t in get_periods(new_solution, periods):
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
         is_stucked = False
         while not is_stucked:
             is_stucked = True
             for i, j in itertools.combinations(range(len(new_solution[t])), 2):
                 is_break = False
-                for k in range(len(new_solution[t][i].customers)+len(new_solution[t][j].customers)):
-                    for l in range(1,4):
-                        c1, c2 = raw_shift(new_solution[t][i].customers, new_solution[t][j].customers, k, l)
-
-                        if c1 is None:
-                            break
-
-                        r1, r2 = Route(new_problem, c1, t_dilivery_quantities), Route(new_problem, c2, t_dilivery_quantities)
-                        if r1.is_feasible and r2.is_feasible:
-                            if r1.total_distance + r2.total_distance < new_solution[t][i].total_distance + new_solution[t][j].total_distance:
-                                if c1 and c2:
-                                    new_solution[t][i] = r1
-                                    new_solution[t][j] = r2
-                                elif not c1:
-                                    new_solution[t][j] = r2
-                                    new_solution[t].remove(new_solution[t][i])
-                                    is_break = True
-                                    break
-                                elif not c2:
-                                    new_solution[t][i] = r1
-                                    new_solution[t].remove(new_solution[t][j])
-                                    is_break = True
-                                    break
-                                
-                                is_stucked = False
+                move = (0, 1)
+                while move is not None:
+                    move, evaluated = find_shift(new_solution[t][i], new_solution[t][j], *move, candidate_lists)
+                    candidates += evaluated
+                    if move is None:
+                        break
 
-                    if is_break:
+                    k, l = move
+                    accepted += 1
+                    c1, c2 = raw_shift(new_solution[t][i].customers, new_solution[t][j].customers, k, l)
+                    r1, r2 = Route(new_problem, c1, t_dilivery_quantities), Route(new_problem, c2, t_dilivery_quantities)
+                    if c1 and c2:
+                        new_solution[t][i] = r1
+                        new_solution[t][j] = r2
+                    elif not c1:
+                        new_solution[t][j] = r2
+                        new_solution[t].remove(new_solution[t][i])
+                        is_break = True
                         break
+                    elif not c2:
+                        new_solution[t][i] = r1
+                        new_solution[t].remove(new_solution[t][j])
+                        is_break = True
+                        break
+
+                    is_stucked = False
+                    move = (k, l+1)
 
                 if is_break:
                     break
 
+    get_instrumentation().record_moves("shift", candidates, accepted)
     return new_problem, new_solution
 
 
 def raw_transfer(problem, solution, t, route, i, j):
-    t_dq_1 = list(list(zip(*problem.dilivery_quantities))[t])
+    t_dq_1 = list(problem.dilivery_quantities[:, t])
     a = route.customers
     time_period_2 = t
     if len(solution[t-1]) - 1 - j >= 0:
         time_period_2 = t-1
         idx = j
         b = solution[t-1][idx].customers
-        t_dq_2 = list(list(zip(*problem.dilivery_quantities))[t-1])
+        t_dq_2 = list(problem.dilivery_quantities[:, t-1])
     else:
         time_period_2 = t+1
         idx = j - len(solution[t-1])
         b = solution[t+1][idx].customers
-        t_dq_2 = list(list(zip(*problem.dilivery_quantities))[t+1])
+        t_dq_2 = list(problem.dilivery_quantities[:, t+1])
 
     if a[i] in b:
         a, b = None, None
@@ -248,26 +576,29 @@ def raw_transfer(problem, solution, t, route, i, j):
     return a, b, time_period_2, idx, t_dq_1, t_dq_2
 
 
-def transfer(problem, solution):
-    new_problem = copy.deepcopy(problem)
-    new_solution = copy.deepcopy(solution)
-    for t in range(len(new_solution)):
+def transfer(problem, solution, periods=None):
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    candidates, accepted = 0, 0
+    for t in get_periods(new_solution, periods):
         is_stucked = False
         while not is_stucked:
             is_stucked = True
             for i in range(len(new_solution[t])):
                 is_break = False
                 for j, customer in enumerate(new_solution[t][i].customers):
-                    if t > 0 and t < new_problem.duration-1:
+                    if is_transfer_period(t, new_problem.duration, periods):
                         for k in range(len(new_solution[t-1])+len(new_solution[t+1])-1):
                             c1, c2, time_period_2, idx, t_dq_1, t_dq_2 = raw_transfer(new_problem, new_solution, t, new_solution[t][i], j, k)
 
                             if c1 is None:
                                 break
 
+                            candidates += 1
                             r1, r2 = Route(new_problem, c1, t_dq_1), Route(new_problem, c2, t_dq_2)
                             
                             if r1.is_feasible and r2.is_feasible:
+                                accepted += 1
                                 if c1 and c2:
                                     new_problem.dilivery_quantities[customer.number-1][t] = t_dq_1[customer.number-1]
                                     new_problem.dilivery_quantities[customer.number-1][time_period_2] = t_dq_2[customer.number-1]
@@ -289,164 +620,418 @@ def transfer(problem, solution):
                 if is_break:
                     break
 
+    get_instrumentation().record_moves("transfer", candidates, accepted)
+    return new_problem, new_solution
+
+
+def random_shift(problem, solution, rng, t):
+    '''
+    Move a random customer of period t to the end of another random route
+    of the period, in place, when that is feasible
+    '''
+    if len(solution[t]) < 2:
+        return False
+    i, j = rng.sample(range(len(solution[t])), 2)
+    source, target = solution[t][i], solution[t][j]
+    k = rng.randrange(len(source.customers))
+    if not delta_relocate(source, target, k).is_feasible:
+        return False
+
+    t_dilivery_quantities = problem.get_t_dilivery_quantities(t)
+    solution[t][j] = Route(problem, target.customers + [source.customers[k]], t_dilivery_quantities)
+    if len(source.customers) > 1:
+        solution[t][i] = Route(problem, source.customers[:k] + source.customers[k+1:], t_dilivery_quantities)
+    else:
+        del solution[t][i]
+    return True
+
+
+def random_transfer(problem, solution, rng, t, periods=None):
+    '''
+    Move a random customer of period t, with its delivery, to a random
+    route of period t-1 or t+1 (see raw_transfer), in place, when that is
+    feasible
+    '''
+    if not (solution[t] and is_transfer_period(t, problem.duration, periods)):
+        return False
+    neighbours = len(solution[t-1]) + len(solution[t+1])
+    if not neighbours:
+        return False
+    i = rng.randrange(len(solution[t]))
+    j = rng.randrange(len(solution[t][i].customers))
+    customer = solution[t][i].customers[j]
+    c1, c2, time_period_2, idx, t_dq_1, t_dq_2 = raw_transfer(problem, solution, t, solution[t][i], j, rng.randrange(neighbours))
+    if c1 is None:
+        return False
+    r1, r2 = Route(problem, c1, t_dq_1), Route(problem, c2, t_dq_2)
+    if not (r1.is_feasible and r2.is_feasible):
+        return False
+
+    problem.dilivery_quantities[customer.number-1][t] = t_dq_1[customer.number-1]
+    problem.dilivery_quantities[customer.number-1][time_period_2] = t_dq_2[customer.number-1]
+    solution[time_period_2][idx] = r2
+    if c1:
+        solution[t][i] = r1
+    else:
+        del solution[t][i]
+    return True
+
+
+def perturb_random(problem, solution, rng, moves=1, periods=None):
+    '''
+    Random kick: moves random shifts or transfers of single customers, each
+    applied when it is feasible. Unlike the other perturbations the result
+    may be worse than the input.
+    '''
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    periods_list = list(get_periods(solution, periods))
+    candidates, accepted = 0, 0
+    for _ in range(moves if periods_list else 0):
+        t = rng.choice(periods_list)
+        candidates += 1
+        if rng.random() < 0.5:
+            accepted += random_shift(new_problem, new_solution, rng, t)
+        else:
+            accepted += random_transfer(new_problem, new_solution, rng, t, periods)
+
+    get_instrumentation().record_moves("perturb_random", candidates, accepted)
     return new_problem, new_solution
 
 
-def perturb_shift(problem, solution):
-    for t in range(len(solution)):
-        min_logistic_ratio, _ = find_logistic_ratio(problem, solution)
-        new_problem = copy.deepcopy(problem)
-        new_solution = copy.deepcopy(solution)
-        t_dilivery_quantities = list(zip(*new_problem.dilivery_quantities))[t]
+def perturb_shift(problem, solution, periods=None):
+    new_problem, new_solution = problem, solution
+    candidates, accepted = 0, 0
+    for t in get_periods(solution, periods):
+        new_problem = problem.copy()
+        new_solution = copy_solution(solution)
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
+        state = SolutionState(problem, solution, track_objective=True)
+        min_logistic_ratio = state.logistic_ratio
         for i, j in itertools.combinations(range(len(solution[t])), 2):
             for k in range(len(solution[t][i].customers)+len(solution[t][j].customers)):
-                temp_problem = copy.deepcopy(problem)
-                temp_solution = copy.deepcopy(solution)
-
-                c1, c2 = raw_shift(temp_solution[t][i].customers, temp_solution[t][j].customers, k)
+                delta = evaluate_shift(state.solution[t][i], state.solution[t][j], k)
 
-                if c1 is None:
+                if delta is None:
                     break
-            
-                r1, r2 = Route(temp_problem, c1, t_dilivery_quantities), Route(temp_problem, c2, t_dilivery_quantities)
 
-                if r1.is_feasible and r2.is_feasible:
-                    if r1.total_distance + r2.total_distance < temp_solution[t][i].total_distance + temp_solution[t][j].total_distance:
-                        if c1 and c2:
-                            temp_solution[t][i] = r1
-                            temp_solution[t][j] = r2
-                        elif not c1:
-                            temp_solution[t][j] = r2
-                            temp_solution[t].remove(temp_solution[t][i])
-                        elif not c2:
-                            temp_solution[t][i] = r1
-                            temp_solution[t].remove(temp_solution[t][j])
-
-                temp_logistic_ratio, _ = find_logistic_ratio(temp_problem, temp_solution)
+                candidates += 1
+                # candidates that leave the solution unchanged cannot improve it
+                if not (delta.is_feasible and delta.distance < 0):
+                    continue
+
+                c1, c2 = raw_shift(state.solution[t][i].customers, state.solution[t][j].customers, k)
+                r1, r2 = Route(state.problem, c1, t_dilivery_quantities), Route(state.problem, c2, t_dilivery_quantities)
+                if c1 and c2:
+                    state.set_route(t, i, r1)
+                    state.set_route(t, j, r2)
+                elif not c1:
+                    state.set_route(t, j, r2)
+                    state.remove_route(t, i)
+                elif not c2:
+                    state.set_route(t, i, r1)
+                    state.remove_route(t, j)
+
+                temp_logistic_ratio = state.logistic_ratio
                 if temp_logistic_ratio < min_logistic_ratio:
                     min_logistic_ratio = temp_logistic_ratio
-                    new_problem = temp_problem
-                    new_solution = temp_solution
+                    new_problem, new_solution = state.snapshot()
+                    accepted += 1
+                state.undo()
             
+    get_instrumentation().record_moves("perturb_shift", candidates, accepted)
     return new_problem, new_solution
 
 
 def raw_insertion(problem, solution, t, i, customer):
     a = solution[t][i].customers + [customer]
-    t_dq = list(list(zip(*problem.dilivery_quantities))[t])
+    t_dq = list(problem.dilivery_quantities[:, t])
     t_dq[customer.number-1] = problem.vehicle_capacity - solution[t][i].total_quantity
 
     return a, t_dq
 
 
-def perturb_insertion(problem, solution):
-    new_problem = copy.deepcopy(problem)
-    new_solution = copy.deepcopy(solution)
-    for t in range(len(new_solution)):
-        min_logistic_ratio, _ = find_logistic_ratio(new_problem, new_solution)
-        t_dilivery_quantities = list(zip(*new_problem.dilivery_quantities))[t]
+def perturb_insertion(problem, solution, periods=None):
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    state = SolutionState(problem, solution, track_objective=True)
+    min_logistic_ratio = state.logistic_ratio
+    candidates, accepted = 0, 0
+    for t in get_periods(new_solution, periods):
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
         customers_list = list(chain(*[route.customers for route in new_solution[t]]))
         customers_list_index = [customer.number for customer in customers_list]
         for i in range(len(new_solution[t])):
             for customer in new_problem.customers:
                 if customer.number not in customers_list_index:
-                    temp_problem = copy.deepcopy(problem)
-                    temp_solution = copy.deepcopy(solution)
+                    c, t_dq = raw_insertion(state.problem, state.solution, t, i, customer)
+                    r = Route(state.problem, c, t_dilivery_quantities)
+                    candidates += 1
 
-                    c, t_dq = raw_insertion(temp_problem, temp_solution, t, i, customer)
-                    r = Route(temp_problem, c, t_dilivery_quantities)
+                    # infeasible insertions leave the solution unchanged
+                    if not r.is_feasible:
+                        continue
 
-                    if r.is_feasible:
-                        temp_problem.dilivery_quantities[customer.number-1][t] = t_dq[customer.number-1]
-                        temp_solution[t][i] = r
+                    state.set_quantity(customer.number-1, t, t_dq[customer.number-1])
+                    state.set_route(t, i, r)
 
-                    temp_logistic_ratio, _ = find_logistic_ratio(temp_problem, temp_solution)
+                    temp_logistic_ratio = state.logistic_ratio
                     if temp_logistic_ratio < min_logistic_ratio:
                         min_logistic_ratio = temp_logistic_ratio
-                        new_problem = temp_problem
-                        new_solution = temp_solution
+                        new_problem, new_solution = state.snapshot()
+                        accepted += 1
+                    state.undo()
 
+    get_instrumentation().record_moves("perturb_insertion", candidates, accepted)
     return new_problem, new_solution
 
 
-def perturb_split(problem, solution):
-    new_problem = copy.deepcopy(problem)
-    new_solution = copy.deepcopy(solution)
-    for t in range(len(solution)):
-        min_logistic_ratio, _ = find_logistic_ratio(new_problem, new_solution)
-        t_dilivery_quantities = list(zip(*new_problem.dilivery_quantities))[t]
-        for i in range(len(new_solution[t])):
+def perturb_split(problem, solution, periods=None):
+    new_problem = problem.copy()
+    new_solution = copy_solution(solution)
+    state = SolutionState(problem, solution, track_objective=True)
+    min_logistic_ratio = state.logistic_ratio
+    candidates, accepted = 0, 0
+    for t in get_periods(solution, periods):
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
+        # candidates are single moves from the input solution, so walk its routes
+        for i in range(len(state.solution[t])):
             is_break = False
-            for j, customer in enumerate(new_solution[t][i].customers):
-                if t > 0 and t < new_problem.duration-1:
-                    for k in range(len(new_solution[t-1])+len(new_solution[t+1])-1):
-                        temp_problem = copy.deepcopy(problem)
-                        temp_solution = copy.deepcopy(solution)
-
-                        c1, c2, time_period_2, idx, t_dq_1, t_dq_2 = raw_transfer(temp_problem, temp_solution, t, temp_solution[t][i], j, k)
+            for j, customer in enumerate(state.solution[t][i].customers):
+                if is_transfer_period(t, state.problem.duration, periods):
+                    for k in range(len(state.solution[t-1])+len(state.solution[t+1])-1):
+                        c1, c2, time_period_2, idx, t_dq_1, t_dq_2 = raw_transfer(state.problem, state.solution, t, state.solution[t][i], j, k)
 
                         if c1 is None:
                             break
                     
-                        r1, r2 = Route(temp_problem, c1, t_dilivery_quantities), Route(temp_problem, c2, t_dilivery_quantities)
-
-                        if r1.is_feasible and r2.is_feasible:
-                            if c1 and c2:
-                                temp_problem.dilivery_quantities[t][customer.number-1] = t_dq_1[customer.number-1]
-                                temp_problem.dilivery_quantities[time_period_2][customer.number-1] = t_dq_2[customer.number-1]
-                                temp_solution[t][i] = r1
-                                temp_solution[time_period_2][idx] = r2
-                            elif not c1:
-                                temp_problem.dilivery_quantities[customer.number-1][t] = t_dq_1[customer.number-1]
-                                temp_problem.dilivery_quantities[customer.number-1][time_period_2] = t_dq_2[customer.number-1]
-                                temp_solution[time_period_2][idx] = r2
-                                temp_solution[t].remove(temp_solution[t][i])
-
-                        temp_logistic_ratio, _ = find_logistic_ratio(temp_problem, temp_solution)
+                        candidates += 1
+                        r1, r2 = Route(state.problem, c1, t_dilivery_quantities), Route(state.problem, c2, t_dilivery_quantities)
+
+                        # infeasible transfers leave the solution unchanged
+                        if not (r1.is_feasible and r2.is_feasible):
+                            continue
+
+                        if c1 and c2:
+                            state.set_quantity(customer.number-1, t, t_dq_1[customer.number-1])
+                            state.set_quantity(customer.number-1, time_period_2, t_dq_2[customer.number-1])
+                            state.set_route(t, i, r1)
+                            state.set_route(time_period_2, idx, r2)
+                        elif not c1:
+                            state.set_quantity(customer.number-1, t, t_dq_1[customer.number-1])
+                            state.set_quantity(customer.number-1, time_period_2, t_dq_2[customer.number-1])
+                            state.set_route(time_period_2, idx, r2)
+                            state.remove_route(t, i)
+
+                        temp_logistic_ratio = state.logistic_ratio
                         if temp_logistic_ratio < min_logistic_ratio:
                             min_logistic_ratio = temp_logistic_ratio
-                            new_problem = temp_problem
-                            new_solution = temp_solution
+                            new_problem, new_solution = state.snapshot()
+                            accepted += 1
                             is_break = True
+                        state.undo()
+                        if is_break:
                             break
                 if is_break:
                     break
             if is_break:
                 break
 
+    get_instrumentation().record_moves("perturb_split", candidates, accepted)
     return new_problem, new_solution
 
 
 class LocalSearch:
-    def __init__(self, problem: Problem):
+    def __init__(self, problem: Problem, granularity=None, periods=None, period_workers=1, cache_bytes=DEFAULT_MAX_BYTES,
+                 adaptive=False, seed=None):
+        '''
+        With granularity k, or_opt, swap and shift only evaluate moves that put
+        a customer next to one of its k nearest neighbours. With periods, the
+        operators leave every other period untouched. With period_workers
+        other than 1, the operators run on slices of the periods in a process
+        pool, see PeriodParallelExecutor. Evaluated states are cached by
+        fingerprint in at most about cache_bytes. With adaptive, optimize
+        picks its operators with an AdaptiveOperatorScheduler.
+        '''
         self.problem: Problem = problem
-
-    def optimize(self, problem, solution: list) -> list:
-        initial_logistic_ratio, _ = find_logistic_ratio(problem, solution)
-        set_ls_operators = [or_opt, swap, shift, transfer]
+        self.periods = periods
+        self.evaluations = EvaluationCache(cache_bytes)
+        self.ls_operators = [or_opt, swap, shift, transfer]
+        if granularity is not None:
+            candidate_lists = problem.get_candidate_lists(granularity)
+            self.ls_operators = [functools.partial(operator, candidate_lists=candidate_lists)
+                                 for operator in [or_opt, swap, shift]] + [transfer]
+        if periods is not None:
+            self.ls_operators = [functools.partial(operator, periods=periods) for operator in self.ls_operators]
+        self.period_executor = None
+        if period_workers != 1:
+            self.period_executor = PeriodParallelExecutor(problem, period_workers, periods)
+            self.ls_operators = [self.period_executor.wrap(operator) for operator in self.ls_operators]
+        self.scheduler = AdaptiveOperatorScheduler(self.ls_operators, seed=seed) if adaptive else None
+
+    def close(self):
+        '''
+        Stop the period worker processes, if any
+        '''
+        if self.period_executor is not None:
+            self.period_executor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def evaluate(self, problem, solution, fingerprint=None):
+        '''
+        Logistic ratio and feasibility of (problem, solution), see evaluate_solution
+        '''
+        return evaluate_solution(self.evaluations, problem, solution, fingerprint)
+
+    def get_cache_stats(self):
+        return {"evaluations": self.evaluations.get_stats()}
+
+    def get_operator_weights(self):
+        '''
+        Final weights of the adaptive operator schedulers, empty without adaptive
+        '''
+        return {"local_search": self.scheduler.get_weights()} if self.scheduler is not None else {}
+
+    def optimize(self, problem, solution: list, deadline=None) -> list:
+        '''
+        Local search, cut short once time.monotonic() passes deadline
+        '''
+        if self.scheduler is not None:
+            return self.optimize_adaptive(problem, solution, deadline)
+        instrumentation = get_instrumentation()
+        initial_logistic_ratio = self.evaluate(problem, solution).logistic_ratio
+        input_logistic_ratio = initial_logistic_ratio
+        new_problem, new_solution = problem, solution
+        set_ls_operators = list(self.ls_operators)
         while set_ls_operators:
             for operator in set_ls_operators:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return new_problem, new_solution
+                start = instrumentation.start()
                 new_problem, new_solution = operator(problem, solution)
-                logistic_ratio, _ = find_logistic_ratio(new_problem, new_solution)
+                logistic_ratio = self.evaluate(new_problem, new_solution).logistic_ratio
+                instrumentation.record_call(operator, start, logistic_ratio - input_logistic_ratio)
                 if logistic_ratio < initial_logistic_ratio:
                     initial_logistic_ratio = logistic_ratio
-                    set_ls_operators = [or_opt, swap, shift, transfer]
+                    set_ls_operators = list(self.ls_operators)
                 else:
                     set_ls_operators.remove(operator)
 
         return new_problem, new_solution
 
+    def optimize_adaptive(self, problem, solution: list, deadline=None) -> list:
+        '''
+        Local search drawing its next operator from the ones that have not
+        failed since the last improvement, weighted by self.scheduler. Each
+        operator works on the incumbent and replaces it when it improves.
+        '''
+        instrumentation = get_instrumentation()
+        logistic_ratio = self.evaluate(problem, solution).logistic_ratio
+        set_ls_operators = list(self.ls_operators)
+        while set_ls_operators:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            operator = self.scheduler.choose(set_ls_operators)
+            start = instrumentation.start()
+            started = time.perf_counter()
+            new_problem, new_solution = operator(problem, solution)
+            new_logistic_ratio = self.evaluate(new_problem, new_solution).logistic_ratio
+            instrumentation.record_call(operator, start, new_logistic_ratio - logistic_ratio)
+            self.scheduler.update(operator, logistic_ratio - new_logistic_ratio, time.perf_counter() - started)
+            if new_logistic_ratio < logistic_ratio:
+                problem, solution, logistic_ratio = new_problem, new_solution, new_logistic_ratio
+                set_ls_operators = list(self.ls_operators)
+            else:
+                set_ls_operators.remove(operator)
+
+        return problem, solution
+
 
 class IteratedLocalSearch(LocalSearch):
-    def __init__(self, problem: Problem):
-        super().__init__(problem)
-        self.initial_solution = ConstructionHeuristic(problem).get_solution()
-
-    def perturbation(self, problem, solution: list) -> list:
-        min_logistic_ratio, _ = find_logistic_ratio(self.problem, solution)
-        for func in [perturb_shift, perturb_insertion, perturb_split]:
-            new_problem, new_solution = func(self.problem, solution)
-            logistic_ratio, _ = find_logistic_ratio(new_problem, new_solution)
+    def __init__(self, problem: Problem, construction_workers=1, initial_solution=None, seed=None, granularity=None,
+                 periods=None, period_workers=1, cache_bytes=DEFAULT_MAX_BYTES, construction_strategy="sequential",
+                 adaptive=False, quantity_reoptimization=False):
+        '''
+        With adaptive, local search and perturbation pick their operators
+        with AdaptiveOperatorScheduler weights: every perturbation step
+        applies one operator, credited with the improvement of the best
+        solution it leads to per second. Adaptive steps are cheaper, so give
+        them a time limit or a patience above 1.
+
+        With quantity_reoptimization, the delivery quantities of every
+        local optimum are raised by reoptimize_quantities before it is
+        compared with the best solution.
+        '''
+        super().__init__(problem, granularity, periods, period_workers, cache_bytes, adaptive, seed)
+        if initial_solution is None:
+            initial_solution = ConstructionHeuristic(problem, construction_workers, strategy=construction_strategy).get_solution()
+        self.initial_solution = initial_solution
+        # with a seed, every perturbation is kicked at random and tries its operators in a random order
+        self.rng = random.Random(seed) if seed is not None else None
+        self.iterations = 0
+        self.quantity_reoptimization = quantity_reoptimization
+        # fingerprints of the perturbed states already optimized, see iterate
+        self.visited = EvaluationCache(cache_bytes)
+        self.revisits = 0
+        self.perturbation_scheduler = None
+        if adaptive:
+            self.perturbation_scheduler = AdaptiveOperatorScheduler(self.get_perturbation_operators(), seed=seed)
+
+    def get_cache_stats(self):
+        stats = super().get_cache_stats()
+        stats["visited"] = self.visited.get_stats()
+        stats["revisits"] = self.revisits
+        return stats
+
+    def get_operator_weights(self):
+        weights = super().get_operator_weights()
+        if self.perturbation_scheduler is not None:
+            weights["perturbation"] = self.perturbation_scheduler.get_weights()
+        return weights
+
+    def get_perturbation_operators(self):
+        operators = [perturb_shift, perturb_insertion, perturb_split]
+        if self.rng is not None:
+            self.rng.shuffle(operators)
+        if self.periods is not None:
+            operators = [functools.partial(operator, periods=self.periods) for operator in operators]
+        return operators
+
+    def kick(self, problem, solution: list):
+        '''
+        perturb_random with 1 to KICK_MOVES moves drawn from self.rng
+        '''
+        instrumentation = get_instrumentation()
+        start = instrumentation.start()
+        logistic_ratio = self.evaluate(problem, solution).logistic_ratio
+        new_problem, new_solution = perturb_random(problem, solution, self.rng, self.rng.randint(1, KICK_MOVES), self.periods)
+        instrumentation.record_call(perturb_random, start, self.evaluate(new_problem, new_solution).logistic_ratio - logistic_ratio)
+        return new_problem, new_solution
+
+    def perturbation(self, problem, solution: list, deadline=None) -> list:
+        '''
+        Apply the perturbation operators to (problem, solution) and keep the
+        best result. With a seed, the input is first kicked at random, so
+        that differently seeded trajectories explore different paths.
+        '''
+        instrumentation = get_instrumentation()
+        if self.rng is not None:
+            problem, solution = self.kick(problem, solution)
+        min_logistic_ratio = self.evaluate(problem, solution).logistic_ratio
+        input_problem, input_solution = problem, solution
+        input_logistic_ratio = min_logistic_ratio
+        for func in self.get_perturbation_operators():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            start = instrumentation.start()
+            new_problem, new_solution = func(input_problem, input_solution)
+            logistic_ratio = self.evaluate(new_problem, new_solution).logistic_ratio
+            instrumentation.record_call(func, start, logistic_ratio - input_logistic_ratio)
             if logistic_ratio < min_logistic_ratio:
                 min_logistic_ratio = logistic_ratio
                 problem = new_problem
@@ -454,25 +1039,103 @@ class IteratedLocalSearch(LocalSearch):
 
         return problem, solution
 
-    def execute(self):
-        logistic_ratio, _ = find_logistic_ratio(self.problem, self.initial_solution)
-
-        best_problem, best_solution = self.optimize(self.problem, self.initial_solution)
-        best_logistic_ratio, _ = find_logistic_ratio(best_problem, best_solution)
+    def adaptive_perturbation(self, problem, solution: list):
+        '''
+        Apply one perturbation operator drawn by self.perturbation_scheduler,
+        returns the perturbed (problem, solution) and the operator
+        '''
+        instrumentation = get_instrumentation()
+        func = self.perturbation_scheduler.choose(self.get_perturbation_operators())
+        start = instrumentation.start()
+        new_problem, new_solution = func(problem, solution)
+        instrumentation.record_call(func, start, self.evaluate(new_problem, new_solution).logistic_ratio
+                                    - self.evaluate(problem, solution).logistic_ratio)
+        return new_problem, new_solution, func
+
+    def find_local_optimum(self, problem, solution: list, deadline=None):
+        '''
+        optimize, followed by the quantity reoptimization when enabled
+        '''
+        problem, solution = self.optimize(problem, solution, deadline)
+        if self.quantity_reoptimization:
+            problem, solution = reoptimize_quantities(problem, solution, self.periods)
+        return problem, solution
 
-        is_stucked = False
-        while not is_stucked:
-            is_stucked = True
-            new_problem, new_solution = self.perturbation(best_problem, best_solution)
-            # new_problem, new_solution = self.optimize(best_problem, best_solution)
-            new_problem, new_solution = self.optimize(new_problem, new_solution)
-            logistic_ratio, _ = find_logistic_ratio(new_problem, new_solution)
-            if logistic_ratio < best_logistic_ratio:
-                best_logistic_ratio = logistic_ratio
-                is_stucked = False
-                best_problem = new_problem
-                best_solution = new_solution
-                print("ILS step")
-                print(best_solution)
+    def reward_perturbation(self, func, improvement, started):
+        if func is not None:
+            self.perturbation_scheduler.update(func, improvement, time.perf_counter() - started)
+
+    def iterate(self, time_limit=None, max_iterations=None, patience=1):
+        '''
+        Anytime search, yields (problem, solution, logistic_ratio) for the
+        first local optimum and again after every improvement. Stops after
+        time_limit seconds, max_iterations perturbation steps, or patience
+        steps in a row without improvement (more than one only pays off
+        with a seed, as unseeded steps repeat themselves).
+
+        Without adaptive, local search is deterministic, so a perturbed state
+        (its routes and delivery quantities, see state_fingerprint) that was
+        already optimized leads back to a local optimum already
+        compared with the best one. Such revisits skip the local search and
+        count as a step without improvement. The operator scheduler of
+        adaptive draws at random, so there every state is optimized again.
+        The period workers are stopped once the search ends or is closed.
+        '''
+        try:
+            deadline = time.monotonic() + time_limit if time_limit is not None else None
+
+            best_problem, best_solution = self.find_local_optimum(self.problem, self.initial_solution, deadline)
+            best_logistic_ratio = self.evaluate(best_problem, best_solution).logistic_ratio
+            yield best_problem, best_solution, best_logistic_ratio
+
+            steps_without_improvement = 0
+            while steps_without_improvement < patience:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                if max_iterations is not None and self.iterations >= max_iterations:
+                    break
+                self.iterations += 1
+                started = time.perf_counter()
+                if self.perturbation_scheduler is None:
+                    func = None
+                    new_problem, new_solution = self.perturbation(best_problem, best_solution, deadline)
+                else:
+                    new_problem, new_solution, func = self.adaptive_perturbation(best_problem, best_solution)
+                fingerprint = state_fingerprint(new_problem, new_solution)
+                if self.scheduler is None and self.visited.get(fingerprint) is not None:
+                    self.revisits += 1
+                    steps_without_improvement += 1
+                    self.reward_perturbation(func, 0.0, started)
+                    continue
+
+                new_problem, new_solution = self.find_local_optimum(new_problem, new_solution, deadline)
+                logistic_ratio = self.evaluate(new_problem, new_solution).logistic_ratio
+                # a local search cut short by the deadline may not be repeated as is
+                if self.scheduler is None and (deadline is None or time.monotonic() < deadline):
+                    self.visited.put(fingerprint, logistic_ratio)
+                self.reward_perturbation(func, best_logistic_ratio - logistic_ratio, started)
+                if logistic_ratio < best_logistic_ratio:
+                    best_logistic_ratio = logistic_ratio
+                    best_problem = new_problem
+                    best_solution = new_solution
+                    steps_without_improvement = 0
+                    yield best_problem, best_solution, best_logistic_ratio
+                else:
+                    steps_without_improvement += 1
+        finally:
+            self.close()
+
+    def execute(self, time_limit=None, max_iterations=None, patience=1, callback=None):
+        '''
+        Run iterate to the end and return the best (problem, solution),
+        callback(problem, solution, logistic_ratio) sees every incumbent
+        '''
+        best_problem, best_solution = self.problem, self.initial_solution
+        try:
+            for best_problem, best_solution, logistic_ratio in self.iterate(time_limit, max_iterations, patience):
+                if callback is not None:
+                    callback(best_problem, best_solution, logistic_ratio)
+        finally:
+            self.close()
 
         return best_problem, best_solution
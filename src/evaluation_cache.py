@@ -0,0 +1,127 @@
+import os
+import sys
+import hashlib
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.utils.utility import find_logistic_ratio
+from src.instrumentation import get_instrumentation
+
+DEFAULT_MAX_BYTES = 64 * 2**20
+# Bytes of bookkeeping per entry on top of its key and value (dict slot and linked list node)
+ENTRY_OVERHEAD = 120
+PERIOD_SEPARATOR = b"|"
+
+Evaluation = namedtuple("Evaluation", ["logistic_ratio", "is_feasible"])
+
+
+def solution_fingerprint(solution):
+    '''
+    Digest of a solution: the fingerprint of every route, period by period
+    in order. The logistic ratio and the feasibility only depend on the
+    customers and quantities of the routes, so equal fingerprints have
+    equal evaluations.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for routes in solution:
+        digest.update(PERIOD_SEPARATOR)
+        for route in routes:
+            digest.update(route.fingerprint)
+    return digest.digest()
+
+
+def state_fingerprint(problem, solution):
+    '''
+    Digest of a (problem, solution) state: solution_fingerprint and the
+    delivery quantities of the problem, which transfer, or_opt and
+    reoptimize_quantities also read for customers on no route. Equal
+    fingerprints lead a deterministic local search to the same optimum.
+    '''
+    digest = hashlib.blake2b(solution_fingerprint(solution), digest_size=16)
+    digest.update(np.ascontiguousarray(problem.dilivery_quantities).tobytes())
+    return digest.digest()
+
+
+class EvaluationCache:
+    '''
+    LRU map from fingerprints to evaluations, holding at most about
+    max_bytes of keys and values. Counts its hits, misses and evictions.
+    '''
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    @staticmethod
+    def get_entry_size(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+
+    def get(self, key, default=None):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.size -= self.get_entry_size(key, self.entries.pop(key))
+        entry_size = self.get_entry_size(key, value)
+        if entry_size > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.size += entry_size
+        while self.size > self.max_bytes:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.size -= self.get_entry_size(old_key, old_value)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+        }
+
+
+def evaluate_solution(cache, problem, solution, fingerprint=None):
+    '''
+    Evaluation of (problem, solution), computed with find_logistic_ratio
+    on a cache miss
+    '''
+    if fingerprint is None:
+        fingerprint = solution_fingerprint(solution)
+    evaluation = cache.get(fingerprint)
+    if evaluation is None:
+        logistic_ratio, _ = find_logistic_ratio(problem, solution)
+        evaluation = Evaluation(float(logistic_ratio), all(route.is_feasible for routes in solution for route in routes))
+        cache.put(fingerprint, evaluation)
+    else:
+        get_instrumentation().count("evaluation_cache_hits")
+    return evaluation
@@ -1,28 +1,73 @@
 import os
 import sys
+import numpy as np
+import pandas as pd
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
-from src.structure import Problem, Customer
+from src.structure import Problem
+
+
+def read_table(path):
+    '''
+    DataFrame from a CSV (local or URL), Parquet or Feather file, chosen by
+    extension. Parquet and Feather need pyarrow.
+    '''
+    extension = os.path.splitext(str(path).split("?")[0])[1].lower()
+    if extension in (".parquet", ".pq"):
+        return pd.read_parquet(path)
+    if extension in (".feather", ".arrow"):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
 
 class FormatParser:
+    delivery_unit_cost = 50000          # VND/km
+    setup_cost_for_one_trip = 300000    # VND/ship
+    vehicle_capacity = 45000            # kg
+
     def __init__(self, customers_df, forecasted_quantity_df):
         self.customers_df = customers_df
         self.forecasted_quantity_df = forecasted_quantity_df
 
-    def get_problem(self) -> Problem:
-        delivery_unit_cost = 50000          # VND/km
-        setup_cost_for_one_trip = 300000    # VND/ship
-        vehicle_capacity = 45000            # kg
+    @classmethod
+    def from_files(cls, customers_path, forecasted_quantity_path):
+        return cls(read_table(customers_path), read_table(forecasted_quantity_path))
+
+    def get_customer_arrays(self) -> dict:
+        '''
+        One array per customer attribute, in the order of Problem.from_arrays
+        '''
+        customers_df = self.customers_df
+        return {
+            "numbers": customers_df.index.to_numpy(),
+            "names": customers_df["Name"].to_numpy(),
+            "latitudes": customers_df["Latitude"].to_numpy(),
+            "longitudes": customers_df["Longtitude"].to_numpy(),
+            "capacities": customers_df["Capacity"].to_numpy(),
+            "near_safety_levels": customers_df["Near safety level"].to_numpy(),
+            "safety_levels": customers_df["Safety level"].to_numpy(),
+            "init_quantities": customers_df["Initial tank quantity"].to_numpy(),
+            "time_windows": customers_df["Time window"].to_numpy(),
+        }
 
-        self.forecasted_quantity_df.set_index('Date', inplace=True)
-        forecasted_quantity_df = self.forecasted_quantity_df.T
-        forecasted_quantity = forecasted_quantity_df.to_numpy()
+    def get_forecasted_quantities(self):
+        '''
+        Forecast matrix with one row per customer and one column per day
+        '''
+        return self.forecasted_quantity_df.set_index('Date').T.to_numpy()
 
-        customers = []
-        for i in range(0,len(self.customers_df)):
-            customers.append(Customer(self.customers_df.iloc[i, :]))
+    def get_problem(self, distance_dtype=np.float64, distance_matrix_path=None) -> Problem:
+        return self.build_problem(self.get_customer_arrays(), self.get_forecasted_quantities(),
+                                  distance_dtype, distance_matrix_path)
 
-        return Problem(customers, forecasted_quantity, delivery_unit_cost, setup_cost_for_one_trip, vehicle_capacity)
-    
\ No newline at end of file
+    @classmethod
+    def build_problem(cls, customer_arrays, forecasted_quantities, distance_dtype=np.float64, distance_matrix_path=None):
+        return Problem.from_arrays(**customer_arrays,
+                                   forecasted_quantities=forecasted_quantities,
+                                   delivery_unit_cost=cls.delivery_unit_cost,
+                                   setup_cost_for_one_trip=cls.setup_cost_for_one_trip,
+                                   vehicle_capacity=cls.vehicle_capacity,
+                                   distance_dtype=distance_dtype,
+                                   distance_matrix_path=distance_matrix_path)
@@ -0,0 +1,165 @@
+import json
+import time
+import marshal
+
+
+class OperatorStats:
+    __slots__ = ("calls", "candidates", "accepted", "time", "objective_change", "code")
+
+    def __init__(self):
+        self.calls = 0
+        self.candidates = 0
+        self.accepted = 0
+        self.time = 0.0
+        self.objective_change = 0.0
+        self.code = None
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "candidates": self.candidates,
+            "accepted": self.accepted,
+            "time": self.time,
+            "objective_change": self.objective_change,
+        }
+
+
+def get_operator_name(operator):
+    '''
+    Name of an operator, seeing through functools.partial
+    '''
+    return getattr(operator, "__name__", None) or operator.func.__name__
+
+
+class Instrumentation:
+    '''
+    Per-operator statistics of LocalSearch and IteratedLocalSearch runs:
+    calls, candidate moves evaluated, accepted moves, cumulative time and
+    change of the logistic ratio, plus counters of copies and full
+    objective evaluations. Record a run by installing it as a context manager:
+
+        with Instrumentation() as instrumentation:
+            IteratedLocalSearch(problem).execute()
+        instrumentation.to_jsonl("stats.jsonl")
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.operators = {}
+        self.counters = {}
+        self._previous = []
+
+    def __enter__(self):
+        global _current
+        self._previous.append(_current)
+        _current = self
+        return self
+
+    def __exit__(self, *args):
+        global _current
+        _current = self._previous.pop()
+
+    def get_operator_stats(self, name):
+        if name not in self.operators:
+            self.operators[name] = OperatorStats()
+        return self.operators[name]
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def start(self):
+        return time.perf_counter()
+
+    def record_call(self, operator, start, objective_change):
+        '''
+        One call of operator started at start(), objective_change being the
+        logistic ratio of its result minus the one of its input
+        '''
+        stats = self.get_operator_stats(get_operator_name(operator))
+        stats.calls += 1
+        stats.time += time.perf_counter() - start
+        stats.objective_change += float(objective_change)
+        if stats.code is None:
+            stats.code = getattr(operator, "func", operator).__code__
+
+    def record_moves(self, name, candidates, accepted):
+        stats = self.get_operator_stats(name)
+        stats.candidates += candidates
+        stats.accepted += accepted
+
+    def merge_records(self, records):
+        '''
+        Add the records of get_records of another instrumentation, such as
+        one that ran in a worker process
+        '''
+        for record in records:
+            if record["type"] == "counter":
+                self.count(record["name"], record["count"])
+                continue
+            stats = self.get_operator_stats(record["name"])
+            stats.calls += record["calls"]
+            stats.candidates += record["candidates"]
+            stats.accepted += record["accepted"]
+            stats.time += record["time"]
+            stats.objective_change += record["objective_change"]
+
+    def reset(self):
+        self.operators = {}
+        self.counters = {}
+
+    def get_records(self):
+        records = [{"type": "operator", "name": name, **stats.to_dict()} for name, stats in self.operators.items()]
+        records.extend({"type": "counter", "name": name, "count": count} for name, count in self.counters.items())
+        return records
+
+    def to_jsonl(self, path, **fields):
+        '''
+        Append one JSON line per operator and per counter to path, fields
+        (a run id, an instance name...) are added to every line
+        '''
+        with open(path, "a") as f:
+            for record in self.get_records():
+                f.write(json.dumps({**fields, **record}) + "\n")
+
+    def dump_stats(self, path):
+        '''
+        Write the operator timings in the marshal format of cProfile, to be
+        read with pstats.Stats(path) or snakeviz
+        '''
+        stats = {}
+        for name, operator_stats in self.operators.items():
+            code = operator_stats.code
+            key = (code.co_filename, code.co_firstlineno, name) if code is not None else ("~", 0, name)
+            stats[key] = (operator_stats.calls, operator_stats.calls, operator_stats.time, operator_stats.time, {})
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+
+class NullInstrumentation(Instrumentation):
+    '''
+    Default instrumentation, every hook is a no-op
+    '''
+    enabled = False
+
+    def count(self, name, n=1):
+        pass
+
+    def start(self):
+        return 0
+
+    def record_call(self, operator, start, objective_change):
+        pass
+
+    def record_moves(self, name, candidates, accepted):
+        pass
+
+    def merge_records(self, records):
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+_current = NULL_INSTRUMENTATION
+
+
+def get_instrumentation():
+    return _current
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.structure import Problem
+from src.construction_heuristic import ConstructionHeuristic, IteratedLocalSearch
+from src.parallel import get_worker_count
+from src.utils.utility import find_logistic_ratio
+
+
+def run_trajectory(problem, initial_solution, seed, deadline=None, start=0, patience=1, max_iterations=None):
+    '''
+    One seeded ILS trajectory, deadline is a time.time() timestamp shared by
+    all workers of a multi-start run. patience and max_iterations are those
+    of IteratedLocalSearch.iterate.
+    '''
+    started_at = time.time()
+    ils = IteratedLocalSearch(problem, initial_solution=initial_solution, seed=seed)
+    time_limit = max(0, deadline - started_at) if deadline is not None else None
+    best_problem, best_solution = ils.execute(time_limit, max_iterations, patience)
+    logistic_ratio, _ = find_logistic_ratio(best_problem, best_solution)
+
+    stats = {
+        "start": start,
+        "seed": seed,
+        "pid": os.getpid(),
+        "logistic_ratio": float(logistic_ratio),
+        "iterations": ils.iterations,
+        "wall_time": time.time() - started_at,
+        "timed_out": deadline is not None and time.time() >= deadline,
+    }
+    return best_problem, best_solution, stats
+
+
+class MultiStartIteratedLocalSearch:
+    '''
+    Independent ILS trajectories with their own seeds, run in a process
+    pool from a shared construction solution. The seed drives the random
+    kick of every perturbation step (see IteratedLocalSearch.kick), so the
+    trajectories take different paths. The best trajectory wins.
+
+    Every trajectory stops after patience perturbation steps in a row
+    without improvement or after max_iterations steps. Without patience,
+    that is 1 step, or no limit when execute is given a time limit so that
+    the trajectories use all of it.
+    '''
+    def __init__(self, problem: Problem, starts=None, workers=None, seed=0, construction_workers=1, patience=None,
+                 max_iterations=None):
+        self.problem: Problem = problem
+        self.workers = get_worker_count(workers)
+        self.starts = starts if starts is not None else self.workers
+        self.seed = seed
+        self.construction_workers = construction_workers
+        self.patience = patience
+        self.max_iterations = max_iterations
+        self.stats = []
+
+    def get_seeds(self):
+        rng = random.Random(self.seed)
+        return [rng.randrange(2**32) for _ in range(self.starts)]
+
+    def execute(self, time_limit=None):
+        '''
+        Best (problem, solution) over all trajectories, per-trajectory
+        statistics are kept in self.stats. The time limit covers the
+        construction too and is checked by each trajectory between ILS steps.
+        '''
+        deadline = time.time() + time_limit if time_limit is not None else None
+        initial_solution = ConstructionHeuristic(self.problem, self.construction_workers).get_solution()
+        patience = self.patience
+        if patience is None:
+            patience = float("inf") if deadline is not None else 1
+
+        results = []
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = [executor.submit(run_trajectory, self.problem, initial_solution, seed, deadline, start,
+                                       patience, self.max_iterations)
+                       for start, seed in enumerate(self.get_seeds())]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+        results.sort(key=lambda result: (result[2]["logistic_ratio"], result[2]["start"]))
+        self.stats = [stats for _, _, stats in results]
+        best_problem, best_solution, _ = results[0]
+        return best_problem, best_solution
@@ -0,0 +1,103 @@
+import os
+import sys
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.utils.utility import find_logistic_ratio
+
+
+class ObjectiveTracker:
+    '''
+    Setup cost, travel cost and delivered quantity of every route and every
+    period of a solution, updated move by move so that the logistic ratio
+    is available without rescanning the solution.
+
+    With debug on, every update is cross-checked against find_logistic_ratio.
+    '''
+    debug = False
+
+    def __init__(self, problem, solution, debug=None):
+        self.problem = problem
+        self.solution = solution
+        if debug is not None:
+            self.debug = debug
+
+        self.route_costs = []
+        self.period_costs = []
+        self.setup_cost = 0
+        self.delivery_cost = 0
+        self.total_delivered_quantity = 0
+        for routes in solution:
+            route_costs = [self.get_route_cost(route) for route in routes]
+            period_setup_cost, period_delivery_cost, period_quantity = 0, 0, 0
+            for setup_cost, delivery_cost, quantity in route_costs:
+                self.setup_cost += setup_cost
+                self.delivery_cost += delivery_cost
+                period_setup_cost += setup_cost
+                period_delivery_cost += delivery_cost
+                period_quantity += quantity
+            self.total_delivered_quantity += period_quantity
+            self.route_costs.append(route_costs)
+            self.period_costs.append((period_setup_cost, period_delivery_cost, period_quantity))
+
+        self.journal = []
+
+    def get_route_cost(self, route):
+        total_quantity = route.total_quantity
+        number_vehicle = np.ceil(total_quantity/self.problem.vehicle_capacity)
+        return (number_vehicle*self.problem.setup_cost_for_one_trip,
+                number_vehicle*route.total_distance*self.problem.delivery_unit_cost,
+                total_quantity)
+
+    @property
+    def logistic_ratio(self):
+        return (self.setup_cost + self.delivery_cost)/self.total_delivered_quantity
+
+    def _update(self, t, removed, added):
+        period_setup_cost, period_delivery_cost, period_quantity = self.period_costs[t]
+        self.journal.append((t, self.period_costs[t], self.setup_cost, self.delivery_cost, self.total_delivered_quantity))
+
+        setup_cost = added[0] - removed[0]
+        delivery_cost = added[1] - removed[1]
+        quantity = added[2] - removed[2]
+        self.period_costs[t] = (period_setup_cost + setup_cost, period_delivery_cost + delivery_cost, period_quantity + quantity)
+        self.setup_cost += setup_cost
+        self.delivery_cost += delivery_cost
+        self.total_delivered_quantity += quantity
+
+    def replace_route(self, t, i, route):
+        cost = self.get_route_cost(route)
+        self._update(t, self.route_costs[t][i], cost)
+        self.journal[-1] += ("route", i, self.route_costs[t][i])
+        self.route_costs[t][i] = cost
+        self.check()
+
+    def remove_route(self, t, i):
+        self._update(t, self.route_costs[t][i], (0, 0, 0))
+        self.journal[-1] += ("remove", i, self.route_costs[t][i])
+        del self.route_costs[t][i]
+        self.check()
+
+    def undo(self, checkpoint=0):
+        '''
+        Restore the figures recorded before the latest changes, exactly
+        rather than by subtracting the changes again
+        '''
+        while len(self.journal) > checkpoint:
+            t, period_costs, setup_cost, delivery_cost, quantity, kind, i, route_cost = self.journal.pop()
+            self.period_costs[t] = period_costs
+            self.setup_cost, self.delivery_cost, self.total_delivered_quantity = setup_cost, delivery_cost, quantity
+            if kind == "route":
+                self.route_costs[t][i] = route_cost
+            else:
+                self.route_costs[t].insert(i, route_cost)
+
+    def check(self):
+        if not self.debug:
+            return
+        logistic_ratio, [setup_cost, delivery_cost, _, _] = find_logistic_ratio(self.problem, self.solution)
+        if not (np.isclose(setup_cost, self.setup_cost) and np.isclose(delivery_cost, self.delivery_cost)
+                and np.isclose(logistic_ratio, self.logistic_ratio)):
+            raise AssertionError(f"Objective tracker is out of sync: {self.logistic_ratio} != {logistic_ratio}")
@@ -0,0 +1,50 @@
+import os
+import sys
+import random
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.instrumentation import get_operator_name
+
+
+class AdaptiveOperatorScheduler:
+    '''
+    Roulette-wheel choice among operators with adaptive weights, as in
+    adaptive large neighbourhood search. Every operator starts with weight
+    1. A call is rewarded with its improvement of the logistic ratio per
+    second, relative to the best rate seen so far, and the weight of the
+    operator moves towards that reward:
+
+        weight = decay * weight + (1 - decay) * reward
+
+    so the weights of operators that stop paying off decay towards 0.
+    Operators are drawn with probability proportional to their weight,
+    never below min_weight so that none of them starves.
+    '''
+    def __init__(self, operators, decay=0.8, min_weight=0.05, seed=None):
+        self.weights = {get_operator_name(operator): 1.0 for operator in operators}
+        self.calls = {name: 0 for name in self.weights}
+        self.decay = decay
+        self.min_weight = min_weight
+        self.best_rate = 0.0
+        self.rng = random.Random(seed)
+
+    def choose(self, operators):
+        weights = [max(self.weights[get_operator_name(operator)], self.min_weight) for operator in operators]
+        return self.rng.choices(operators, weights)[0]
+
+    def update(self, operator, improvement, elapsed):
+        '''
+        Reward one call of operator that improved the logistic ratio by
+        improvement (negative when it got worse) in elapsed seconds
+        '''
+        name = get_operator_name(operator)
+        rate = max(improvement, 0.0) / max(elapsed, 1e-9)
+        self.best_rate = max(self.best_rate, rate)
+        reward = rate / self.best_rate if self.best_rate > 0 else 0.0
+        self.weights[name] = self.decay * self.weights[name] + (1 - self.decay) * reward
+        self.calls[name] += 1
+
+    def get_weights(self):
+        return dict(self.weights)
@@ -0,0 +1,59 @@
+import os
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+
+def get_worker_count(workers=None):
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+class SharedArrays:
+    '''
+    Copy of a dict of NumPy arrays placed in shared memory, so that worker
+    processes can map them read-only instead of receiving pickled copies
+    '''
+    def __init__(self, arrays: dict):
+        self.blocks = []
+        self.descriptors = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.descriptors[name] = (block.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# Shared memory blocks a worker has attached to, kept alive for its lifetime
+_attached_blocks = []
+
+
+def attach_shared_arrays(descriptors):
+    '''
+    Read-only views of the arrays described by SharedArrays.descriptors
+    '''
+    arrays = {}
+    for name, (block_name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _attached_blocks.append(block)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.setflags(write=False)
+        arrays[name] = array
+    return arrays
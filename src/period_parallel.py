@@ -0,0 +1,167 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.structure import Problem, Route
+from src.solution_state import copy_solution
+from src.parallel import get_worker_count
+from src.instrumentation import Instrumentation, NULL_INSTRUMENTATION, get_instrumentation
+
+# Operators that move customers between a period and its neighbours, the others stay within one period
+CROSS_PERIOD_OPERATORS = ("transfer",)
+
+
+def encode_periods(solution, periods):
+    '''
+    Routes of the given periods as (customer numbers, delivery quantities)
+    pairs, which pickle without the problem
+    '''
+    return {t: [(route.numbers[1:-1], route.t_dilivery_quantities) for route in solution[t]] for t in periods}
+
+
+def decode_periods(problem, customers, encoded, solution):
+    '''
+    Put the routes of encode_periods back into solution, customers maps
+    numbers to the problem's Customer objects
+    '''
+    for t, routes in encoded.items():
+        solution[t] = [Route(problem, [customers[number] for number in numbers], t_dilivery_quantities)
+                       for numbers, t_dilivery_quantities in routes]
+    return solution
+
+
+def split_chunks(periods, chunks):
+    return [chunk.tolist() for chunk in np.array_split(np.asarray(periods, dtype=np.int64), chunks) if len(chunk)]
+
+
+# Problem of a period worker process, see _init_period_worker
+_worker_problem = None
+_worker_customers = None
+
+
+def _init_period_worker(problem):
+    global _worker_problem, _worker_customers
+    _worker_problem = problem
+    _worker_customers = {customer.number: customer for customer in problem.customers}
+
+
+def _run_operator_in_worker(operator, dilivery_quantities, encoded, period_groups, record):
+    '''
+    Apply operator to every group of periods in turn, on a solution holding
+    only the encoded periods. Returns the encoded periods, their deliveries
+    and, with record, the records of the instrumentation of the run.
+    '''
+    problem = _worker_problem.copy()
+    problem.dilivery_quantities = dilivery_quantities
+    solution = decode_periods(problem, _worker_customers, encoded, [[] for _ in range(problem.duration)])
+    instrumentation = Instrumentation() if record else NULL_INSTRUMENTATION
+    with instrumentation:
+        for periods in period_groups:
+            problem, solution = operator(problem, solution, periods=periods)
+
+    touched = sorted(encoded)
+    return encode_periods(solution, touched), problem.dilivery_quantities[:, touched], instrumentation.get_records()
+
+
+class PeriodParallelOperator:
+    '''
+    Local search operator run over slices of the periods in a process pool,
+    with the same name and signature as the operator it wraps
+    '''
+    def __init__(self, executor, operator):
+        self.executor = executor
+        self.operator = operator
+        self.func = operator
+        while hasattr(self.func, "func"):
+            self.func = self.func.func
+        self.__name__ = self.func.__name__
+
+    def __call__(self, problem, solution):
+        if self.__name__ in CROSS_PERIOD_OPERATORS:
+            return self.executor.run_cross_period(self.operator, problem, solution)
+        return self.executor.run_intra_period(self.operator, problem, solution)
+
+
+class PeriodParallelExecutor:
+    '''
+    Process pool running local search operators on independent periods.
+
+    Operators that stay within a period (or_opt, swap, shift) handle every
+    period independently, so slices of periods run concurrently and the
+    merged result equals the sequential one. transfer moves customers from
+    period t to t-1 or t+1 and runs in three synchronized phases, on the
+    periods t with t % 3 equal to 0, 1 then 2, whose neighbourhoods do not
+    overlap. That order differs from the sequential t = 1, 2, 3... so
+    transfer may end in another local optimum.
+
+    The pool starts on first use and keeps a copy of the problem in every
+    worker, tasks only carry routes and delivery quantities.
+    '''
+    def __init__(self, problem: Problem, workers=None, periods=None):
+        self.problem: Problem = problem
+        self.workers = get_worker_count(workers)
+        self.periods = periods
+        self.customers = {customer.number: customer for customer in problem.customers}
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_period_worker, initargs=(self.problem,))
+        return self.pool
+
+    def wrap(self, operator):
+        return PeriodParallelOperator(self, operator)
+
+    def get_periods(self, solution):
+        return list(range(len(solution)) if self.periods is None else self.periods)
+
+    def run_tasks(self, operator, problem, solution, tasks):
+        '''
+        Run (touched periods, period groups) tasks and merge their results
+        into a copy of (problem, solution). The moves and counters the
+        workers record are added to the current instrumentation.
+        '''
+        instrumentation = get_instrumentation()
+        new_problem = problem.copy()
+        new_solution = copy_solution(solution)
+        futures = [self.get_pool().submit(_run_operator_in_worker, operator, problem.dilivery_quantities,
+                                          encode_periods(solution, touched), period_groups, instrumentation.enabled)
+                   for touched, period_groups in tasks]
+        for future in futures:
+            encoded, dilivery_quantities, records = future.result()
+            decode_periods(new_problem, self.customers, encoded, new_solution)
+            new_problem.dilivery_quantities[:, sorted(encoded)] = dilivery_quantities
+            instrumentation.merge_records(records)
+        return new_problem, new_solution
+
+    def run_intra_period(self, operator, problem, solution):
+        chunks = split_chunks(self.get_periods(solution), 2*self.workers)
+        return self.run_tasks(operator, problem, solution, [(chunk, [chunk]) for chunk in chunks])
+
+    def run_cross_period(self, operator, problem, solution):
+        periods = self.get_periods(solution)
+        open_periods = set(periods)
+        sources = [t for t in periods if 0 < t < len(solution)-1 and t-1 in open_periods and t+1 in open_periods]
+        for phase in range(3):
+            phase_sources = [t for t in sources if t % 3 == phase]
+            tasks = []
+            for chunk in split_chunks(phase_sources, self.workers):
+                touched = sorted({period for t in chunk for period in (t-1, t, t+1)})
+                tasks.append((touched, [(t-1, t, t+1) for t in chunk]))
+            problem, solution = self.run_tasks(operator, problem, solution, tasks)
+        return problem, solution
@@ -0,0 +1,98 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.format_parser import FormatParser, read_table
+from src.structure import Customer, Problem
+
+# Bump when the parsed layout changes, so that stale cache entries are ignored
+CACHE_VERSION = 1
+
+CUSTOMER_ARRAYS = ("numbers", "names", "latitudes", "longitudes", "capacities", "near_safety_levels",
+                   "safety_levels", "init_quantities", "time_windows")
+TEXT_ARRAYS = ("names", "time_windows")
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProblemCache:
+    '''
+    Parsed inputs stored as .npy files under cache_dir, keyed by the hash
+    of the file contents. The customer master (its arrays and distance
+    matrix) and the forecast are cached separately, so scenarios sharing a
+    customer file parse it and build its distance matrix only once.
+    Cached arrays are memory-mapped read-only.
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_entry(self, kind, path):
+        return os.path.join(self.cache_dir, f"{kind}-v{CACHE_VERSION}-{hash_file(path)}")
+
+    def save_entry(self, entry, arrays: dict):
+        # written next to the entry and renamed, so readers never see a partial one
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_dir, f"{name}.npy"), array, allow_pickle=False)
+        try:
+            os.rename(temp_dir, entry)
+        except OSError:
+            # another process cached the same input meanwhile
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def load_entry(entry, names):
+        return {name: np.load(os.path.join(entry, f"{name}.npy"), mmap_mode='r') for name in names}
+
+    def get_customer_arrays(self, customers_path):
+        '''
+        Customer arrays of customers_path and the cache entry holding them
+        '''
+        entry = self.get_entry("customers", customers_path)
+        if not os.path.isdir(entry):
+            arrays = FormatParser(read_table(customers_path), None).get_customer_arrays()
+            for name in TEXT_ARRAYS:
+                arrays[name] = arrays[name].astype(str)
+            self.save_entry(entry, arrays)
+        return self.load_entry(entry, CUSTOMER_ARRAYS), entry
+
+    def get_forecasted_quantities(self, forecasted_quantity_path):
+        entry = self.get_entry("forecast", forecasted_quantity_path)
+        if not os.path.isdir(entry):
+            forecasted_quantities = FormatParser(None, read_table(forecasted_quantity_path)).get_forecasted_quantities()
+            self.save_entry(entry, {"forecasted_quantities": forecasted_quantities})
+        return np.asarray(self.load_entry(entry, ["forecasted_quantities"])["forecasted_quantities"])
+
+    @staticmethod
+    def get_distance_matrix_path(entry, distance_dtype=np.float64):
+        return os.path.join(entry, f"distance_matrix-{np.dtype(distance_dtype).name}.npy")
+
+    def get_distance_matrix(self, customers_path, distance_dtype=np.float64):
+        '''
+        Distance matrix of customers_path, built and cached on first use
+        '''
+        customer_arrays, entry = self.get_customer_arrays(customers_path)
+        is_depot = customer_arrays["numbers"] == 0
+        depot = Customer(*[customer_arrays[name][is_depot].tolist()[0] for name in CUSTOMER_ARRAYS])
+        return Problem.get_distance_matrix(depot, customer_arrays["numbers"][~is_depot], customer_arrays["latitudes"][~is_depot],
+                                           customer_arrays["longitudes"][~is_depot], distance_dtype,
+                                           self.get_distance_matrix_path(entry, distance_dtype))
+
+    def load_problem(self, customers_path, forecasted_quantity_path, distance_dtype=np.float64) -> Problem:
+        customer_arrays, entry = self.get_customer_arrays(customers_path)
+        forecasted_quantities = self.get_forecasted_quantities(forecasted_quantity_path)
+        return FormatParser.build_problem(customer_arrays, forecasted_quantities, distance_dtype,
+                                          self.get_distance_matrix_path(entry, distance_dtype))
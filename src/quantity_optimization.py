@@ -0,0 +1,108 @@
+import os
+import sys
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.structure import Problem, Route
+from src.instrumentation import get_instrumentation
+from src.utils.utility import simulate_inventory, find_filled_levels, find_inventory_violations
+
+
+def get_route_quantities(problem: Problem, solution):
+    '''
+    Problem.dilivery_quantities with the entries on a route replaced by the
+    quantities the route carries, and the mask of those entries
+    '''
+    route_quantities = np.array(problem.dilivery_quantities, dtype=np.float64)
+    is_serviced = np.zeros(route_quantities.shape, dtype=bool)
+    for t, routes in enumerate(solution):
+        for route in routes:
+            rows = np.asarray(route.numbers[1:-1], dtype=np.intp) - 1
+            route_quantities[rows, t] = [route.t_dilivery_quantities[row] for row in rows.tolist()]
+            is_serviced[rows, t] = True
+    return route_quantities, is_serviced
+
+
+def find_delivery_headroom(init_quantities, scaling_factors, dilivery_quantities, running_levels, is_serviced, t):
+    '''
+    Largest extra quantity every customer can receive on day t without
+    overfilling its tank on day t or on any later delivery day, which all
+    see the extra quantity in their starting level
+    '''
+    filled_levels = find_filled_levels(init_quantities, scaling_factors, dilivery_quantities, running_levels)
+    slack = np.where(is_serviced[:, t:], 100 - filled_levels[:, t:], np.inf)
+    headroom = slack.min(axis=1) / scaling_factors
+    return np.floor(np.clip(headroom, 0, None))
+
+
+def allocate_route_slack(headroom, slack):
+    '''
+    Split a route's spare vehicle capacity among its customers in visiting
+    order, each one taking up to its headroom
+    '''
+    taken_before = np.cumsum(headroom) - headroom
+    return np.clip(slack - taken_before, 0, headroom)
+
+
+def reoptimize_quantities(problem: Problem, solution, periods=None):
+    '''
+    Keep the routes and raise the quantities they deliver, period by
+    period, so that every trip carries as much as the vehicle and the
+    tanks allow. The number of vehicles of every route stays the same,
+    so the costs do not change while the delivered quantity, the
+    denominator of the logistic ratio, grows. Deliveries that are not on
+    a route are kept. When the result has more entries below the safety
+    level or overfilling a tank than the input, see check_inventory, the
+    input problem and solution are returned unchanged.
+    '''
+    new_problem = problem.copy()
+    init_quantities = np.asarray(new_problem.init_quantities, dtype=np.float64)
+    scaling_factors = 100 / np.asarray(new_problem.capacities, dtype=np.float64)
+    forecasted_quantities = np.asarray(new_problem.forecasted_quantities, dtype=np.float64)
+    dilivery_quantities, is_serviced = get_route_quantities(new_problem, solution)
+    running_levels = simulate_inventory(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities)
+    vehicle_capacity = new_problem.vehicle_capacity
+
+    changed = 0
+    for t in (range(len(solution)) if periods is None else periods):
+        if not solution[t]:
+            continue
+        headroom = find_delivery_headroom(init_quantities, scaling_factors, dilivery_quantities, running_levels, is_serviced, t)
+        extra = np.zeros(len(headroom))
+        for route in solution[t]:
+            rows = np.asarray(route.numbers[1:-1], dtype=np.intp) - 1
+            load = dilivery_quantities[rows, t].sum()
+            # a route delivering nothing costs nothing and must stay so
+            vehicles = np.ceil(load / vehicle_capacity)
+            extra[rows] = allocate_route_slack(headroom[rows], vehicles*vehicle_capacity - load)
+        if extra.any():
+            changed += int(np.count_nonzero(extra))
+            dilivery_quantities[:, t] += extra
+            simulate_inventory(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities, running_levels, t)
+
+    get_instrumentation().record_moves("reoptimize_quantities", int(is_serviced.sum()), changed)
+    new_problem.dilivery_quantities = dilivery_quantities.astype(new_problem.dilivery_quantities.dtype)
+    new_solution = []
+    for t, routes in enumerate(solution):
+        t_dilivery_quantities = new_problem.get_t_dilivery_quantities(t)
+        new_solution.append([Route(new_problem, route.customers, t_dilivery_quantities) for route in routes])
+
+    below_safety, overfilled = check_inventory(problem)
+    new_below_safety, new_overfilled = check_inventory(new_problem)
+    if new_below_safety > below_safety or new_overfilled > overfilled:
+        get_instrumentation().count("reoptimize_quantities_rejected")
+        return problem, solution
+    return new_problem, new_solution
+
+
+def check_inventory(problem: Problem):
+    '''
+    Count of (customer, day) entries of the problem's deliveries below the
+    safety level and overfilling the tank, see find_inventory_violations
+    '''
+    is_below_safety, is_overfilled = find_inventory_violations(
+        problem.init_quantities, 100 / problem.capacities, np.asarray(problem.forecasted_quantities),
+        problem.dilivery_quantities, problem.safety_levels)
+    return int(is_below_safety.sum()), int(is_overfilled.sum())
@@ -0,0 +1,71 @@
+import os
+import sys
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.objective_tracker import ObjectiveTracker
+from src.instrumentation import get_instrumentation
+
+
+def copy_solution(solution):
+    '''
+    Copy the period lists of a solution, routes are never changed in place
+    so they are shared with the original
+    '''
+    get_instrumentation().count("solution_copies")
+    return [list(routes) for routes in solution]
+
+
+class SolutionState:
+    '''
+    Mutable (problem, solution) pair. Every change is recorded in a journal
+    so that a candidate move can be applied, evaluated and undone without
+    copying the problem or the solution.
+
+    With track_objective, an ObjectiveTracker follows every route change
+    and gives the logistic ratio of the current state.
+    '''
+    def __init__(self, problem, solution, track_objective=False):
+        self.problem = problem.copy()
+        self.solution = copy_solution(solution)
+        self.journal = []
+        self.objective = ObjectiveTracker(self.problem, self.solution) if track_objective else None
+
+    @property
+    def logistic_ratio(self):
+        return self.objective.logistic_ratio
+
+    def checkpoint(self):
+        return len(self.journal)
+
+    def set_route(self, t, i, route):
+        self.journal.append(("route", t, i, self.solution[t][i]))
+        self.solution[t][i] = route
+        if self.objective is not None:
+            self.objective.replace_route(t, i, route)
+
+    def remove_route(self, t, i):
+        self.journal.append(("remove", t, i, self.solution[t][i]))
+        del self.solution[t][i]
+        if self.objective is not None:
+            self.objective.remove_route(t, i)
+
+    def set_quantity(self, i, t, value):
+        self.journal.append(("quantity", i, t, self.problem.dilivery_quantities[i][t]))
+        self.problem.dilivery_quantities[i][t] = value
+
+    def undo(self, checkpoint=0):
+        while len(self.journal) > checkpoint:
+            kind, a, b, value = self.journal.pop()
+            if kind != "quantity" and self.objective is not None:
+                self.objective.undo(len(self.objective.journal) - 1)
+            if kind == "route":
+                self.solution[a][b] = value
+            elif kind == "remove":
+                self.solution[a].insert(b, value)
+            else:
+                self.problem.dilivery_quantities[a][b] = value
+
+    def snapshot(self):
+        return self.problem.copy(), copy_solution(self.solution)
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.structure import Problem, Route
+
+# Bump when the columnar layout changes
+FORMAT_VERSION = 1
+
+# One value per route, in the order they were written
+ROUTE_COLUMNS = {
+    "route_ids": np.int64,
+    "periods": np.int32,
+    "offsets": np.int64,
+    "lengths": np.int32,
+    "distances": np.float64,
+    "loads": np.float64,
+}
+# One value per stop, the stops of route k being offsets[k]:offsets[k]+lengths[k]
+STOP_COLUMNS = {
+    "customers": np.int32,
+    "quantities": np.float64,
+}
+META_FILE = "meta.json"
+
+
+class SolutionWriter:
+    '''
+    Writes the routes of a solution, period by period, to a JSON lines
+    file (one route per line) and/or a columnar directory: one raw binary
+    file per column of ROUTE_COLUMNS and STOP_COLUMNS, appended as periods
+    are written, and a meta.json with the dtypes and counts written on
+    close. The output of a period is not held in memory once written. The
+    ILS only settles its solution at the end, so main.py writes it after
+    the search.
+
+        with SolutionWriter(jsonl_path="routes.jsonl", columnar_dir="routes") as writer:
+            for t, routes in enumerate(solution):
+                writer.write_period(t, routes)
+    '''
+    def __init__(self, jsonl_path=None, columnar_dir=None):
+        self.jsonl_path = jsonl_path
+        self.columnar_dir = columnar_dir
+        self.jsonl_file = open(jsonl_path, "w") if jsonl_path is not None else None
+        self.column_files = {}
+        if columnar_dir is not None:
+            os.makedirs(columnar_dir, exist_ok=True)
+            # a directory left by an interrupted run must not look complete
+            if os.path.exists(os.path.join(columnar_dir, META_FILE)):
+                os.remove(os.path.join(columnar_dir, META_FILE))
+            self.column_files = {name: open(os.path.join(columnar_dir, f"{name}.bin"), "wb")
+                                 for name in (*ROUTE_COLUMNS, *STOP_COLUMNS)}
+        self.routes = 0
+        self.stops = 0
+        self.total_distance = 0.0
+        self.total_quantity = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_period(self, t, routes):
+        lengths = [len(route.customers) for route in routes]
+        customers = np.fromiter((number for route in routes for number in route.numbers[1:-1]),
+                                dtype=STOP_COLUMNS["customers"], count=sum(lengths))
+        quantities = np.fromiter((route.t_dilivery_quantities[number-1] for route in routes for number in route.numbers[1:-1]),
+                                 dtype=STOP_COLUMNS["quantities"], count=sum(lengths))
+        columns = {
+            "route_ids": np.arange(self.routes, self.routes + len(routes)),
+            "periods": np.full(len(routes), t),
+            "offsets": self.stops + np.cumsum([0, *lengths], dtype=np.int64)[:-1],
+            "lengths": lengths,
+            "distances": [route.total_distance for route in routes],
+            "loads": [route.total_quantity for route in routes],
+        }
+
+        if self.jsonl_file is not None:
+            start = 0
+            for k, route in enumerate(routes):
+                end = start + lengths[k]
+                self.jsonl_file.write(json.dumps({
+                    "route": self.routes + k,
+                    "period": t,
+                    "customers": customers[start:end].tolist(),
+                    "quantities": quantities[start:end].tolist(),
+                    "distance": float(route.total_distance),
+                    "load": float(route.total_quantity),
+                }) + "\n")
+                start = end
+
+        if self.column_files:
+            for name, dtype in ROUTE_COLUMNS.items():
+                np.asarray(columns[name], dtype=dtype).tofile(self.column_files[name])
+            customers.tofile(self.column_files["customers"])
+            quantities.tofile(self.column_files["quantities"])
+
+        self.routes += len(routes)
+        self.stops += len(customers)
+        self.total_distance += float(np.sum(columns["distances"]))
+        self.total_quantity += float(np.sum(columns["loads"]))
+
+    def write_solution(self, solution, start=0):
+        for t, routes in enumerate(solution[start:], start):
+            self.write_period(t, routes)
+
+    def close(self):
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+            self.jsonl_file = None
+        if self.column_files:
+            for f in self.column_files.values():
+                f.close()
+            self.column_files = {}
+            meta = {
+                "version": FORMAT_VERSION,
+                "routes": self.routes,
+                "stops": self.stops,
+                "total_distance": self.total_distance,
+                "total_quantity": self.total_quantity,
+                "columns": {name: np.dtype(dtype).str for name, dtype in {**ROUTE_COLUMNS, **STOP_COLUMNS}.items()},
+            }
+            with open(os.path.join(self.columnar_dir, META_FILE), "w") as f:
+                json.dump(meta, f)
+
+
+class ColumnarSolution:
+    '''
+    Read-only view of a columnar directory of SolutionWriter, every column
+    is memory-mapped
+    '''
+    def __init__(self, columnar_dir):
+        with open(os.path.join(columnar_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"unsupported solution format version {self.meta['version']}")
+        for name, dtype in self.meta["columns"].items():
+            count = self.meta["stops"] if name in STOP_COLUMNS else self.meta["routes"]
+            path = os.path.join(columnar_dir, f"{name}.bin")
+            # np.memmap refuses empty files
+            setattr(self, name, np.memmap(path, dtype=dtype, mode="r", shape=(count,)) if count else np.empty(0, dtype=dtype))
+
+    def __len__(self):
+        return self.meta["routes"]
+
+    def get_stops(self, k):
+        '''
+        Customer numbers and delivered quantities of route k
+        '''
+        start = int(self.offsets[k])
+        end = start + int(self.lengths[k])
+        return self.customers[start:end], self.quantities[start:end]
+
+    def get_dilivery_quantities(self, size, duration):
+        '''
+        Delivered quantities as a (customers, periods) array like Problem.dilivery_quantities
+        '''
+        dilivery_quantities = np.zeros((size, duration))
+        periods = np.repeat(np.asarray(self.periods), np.asarray(self.lengths))
+        dilivery_quantities[np.asarray(self.customers) - 1, periods] = self.quantities
+        return dilivery_quantities
+
+    def to_solution(self, problem: Problem):
+        '''
+        Routes of the problem, one list per period. The delivery quantities
+        of every route are the ones stored for its period.
+        '''
+        customers = {customer.number: customer for customer in problem.customers}
+        dilivery_quantities = self.get_dilivery_quantities(len(problem.customers), problem.duration)
+        solution = [[] for _ in range(problem.duration)]
+        t_dilivery_quantities = [tuple(dilivery_quantities[:, t]) for t in range(problem.duration)]
+        for k in range(len(self)):
+            t = int(self.periods[k])
+            numbers, _ = self.get_stops(k)
+            solution[t].append(Route(problem, [customers[number] for number in numbers.tolist()], t_dilivery_quantities[t]))
+        return solution
+
+
+def write_solution(solution, jsonl_path=None, columnar_dir=None):
+    with SolutionWriter(jsonl_path, columnar_dir) as writer:
+        writer.write_solution(solution)
+
+
+def load_solution(columnar_dir, problem: Problem):
+    return ColumnarSolution(columnar_dir).to_solution(problem)
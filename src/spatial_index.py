@@ -0,0 +1,232 @@
+import os
+import sys
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.utils.utility import EARTH_RADIUS, CandidateLists, find_haversine_distances
+
+# Points per grid cell the cell size aims at
+BUCKET_SIZE = 4
+# Customers past which nearest neighbours come from the index rather than
+# from a dense slice of the distance matrix, which takes n * n floats
+SPATIAL_INDEX_MIN_CUSTOMERS = 5000
+
+
+def find_sphere_coordinates(latitudes, longitudes):
+    '''
+    Locations as 3D points on the earth's sphere, in km. The straight line
+    (chord) distance between two points grows with their haversine distance.
+    '''
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return EARTH_RADIUS * np.column_stack((np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)))
+
+
+def find_cell_size(points, bucket_size=BUCKET_SIZE):
+    '''
+    Side in km of the grid cells holding about bucket_size of the points,
+    taking the points to spread over the two largest spans of their box
+    '''
+    if not len(points):
+        return 1.0
+    spans = np.sort(np.ptp(points, axis=0))[::-1]
+    if spans[1] > 0:
+        return float(np.sqrt(spans[0] * spans[1] * bucket_size / len(points)))
+    # points on a line, or all at the same place
+    return float(spans[0] * bucket_size / len(points)) if spans[0] > 0 else 1.0
+
+
+class Grid:
+    '''
+    Points bucketed by cell of a uniform 3D grid, the points of cell j
+    being indices[starts[j]:starts[j+1]]
+    '''
+    def __init__(self, indices, points, cell_size):
+        cells = np.floor(points[indices] / cell_size).astype(np.int64)
+        self.cells, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        self.indices = indices[np.argsort(inverse.ravel(), kind="stable")]
+        self.starts = np.concatenate(([0], np.cumsum(counts)))
+
+    def get_rings(self, cell):
+        '''
+        Chebyshev distance, in cells, of every occupied cell from cell
+        '''
+        return np.abs(self.cells - cell).max(axis=1)
+
+    def get_indices(self, cells):
+        return np.concatenate([self.indices[self.starts[j]:self.starts[j+1]] for j in cells.tolist()])
+
+
+class SpatialIndex:
+    '''
+    Nearest customer queries on latitudes and longitudes without pairwise
+    distances. Customers are bucketed in a 3D grid over their points on the
+    sphere, one grid per time window and one for all of them. A k nearest
+    query visits the cells ring by ring around the query point, and stops
+    once no unvisited cell can hold a point nearer than the kth found. A
+    point in ring r + 1 is more than r cells away, so that is when the kth
+    chord distance is at most r cells. Distances returned are haversine
+    distances as in find_distance_matrix, ties broken by customer number.
+    '''
+    def __init__(self, numbers, latitudes, longitudes, time_windows, bucket_size=BUCKET_SIZE):
+        self.numbers = np.asarray(numbers, dtype=np.int64)
+        self.latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+        self.longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+        self.time_windows = np.asarray([str(time_window) for time_window in time_windows], dtype=object)
+        self.rows = {number: row for row, number in enumerate(self.numbers.tolist())}
+
+        self.points = find_sphere_coordinates(latitudes, longitudes)
+        self.cell_size = find_cell_size(self.points, bucket_size)
+        self.grids = {None: Grid(np.arange(len(self.numbers)), self.points, self.cell_size)}
+        for time_window in np.unique(self.time_windows).tolist():
+            self.grids[time_window] = Grid(np.flatnonzero(self.time_windows == time_window), self.points, self.cell_size)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def get_grid(self, time_window):
+        if time_window is None:
+            return self.grids[None]
+        return self.grids.get(str(time_window))
+
+    def find_distances(self, latitude, longitude, rows):
+        '''
+        Haversine distance in km from a location, in radians, to the customers at rows
+        '''
+        return find_haversine_distances(latitude, longitude, self.latitudes[rows], self.longitudes[rows])
+
+    def sort_rows(self, latitude, longitude, rows, count=None):
+        distances = self.find_distances(latitude, longitude, rows)
+        order = np.lexsort((self.numbers[rows], distances))[:count]
+        return self.numbers[rows[order]], distances[order]
+
+    def query(self, latitude, longitude, k, time_window=None, exclude=None):
+        '''
+        Numbers of the k customers nearest to a location in degrees, of the
+        given time window if any, and their distances in km, nearest first.
+        The customer numbered exclude is left out.
+        '''
+        return self.query_point(np.radians(latitude), np.radians(longitude),
+                                find_sphere_coordinates(latitude, longitude)[0], k, time_window, exclude)
+
+    def query_point(self, latitude, longitude, point, k, time_window, exclude):
+        grid = self.get_grid(time_window)
+        if grid is None or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        exclude_row = self.rows.get(exclude, -1)
+        rings = grid.get_rings(np.floor(point / self.cell_size).astype(np.int64))
+        order = np.argsort(rings, kind="stable")
+        rings = rings[order]
+        bounds = np.flatnonzero(np.diff(rings)) + 1
+
+        rows = np.empty(0, dtype=np.int64)
+        chords = np.empty(0)
+        for cells, ring in zip(np.split(order, bounds), rings[np.concatenate(([0], bounds))].tolist()):
+            new_rows = grid.get_indices(cells)
+            new_rows = new_rows[new_rows != exclude_row]
+            rows = np.concatenate((rows, new_rows))
+            chords = np.concatenate((chords, np.linalg.norm(self.points[new_rows] - point, axis=1)))
+            if len(rows) >= k and np.partition(chords, k-1)[k-1] <= ring * self.cell_size:
+                break
+
+        if len(rows) > k:
+            # keep the chord ties at the kth, their haversine order decides
+            rows = rows[chords <= np.partition(chords, k-1)[k-1]]
+        return self.sort_rows(latitude, longitude, rows, k)
+
+    def query_radius(self, latitude, longitude, radius, time_window=None, exclude=None):
+        '''
+        Numbers of the customers within radius km of a location in degrees,
+        of the given time window if any, and their distances, nearest first
+        '''
+        return self.query_radius_point(np.radians(latitude), np.radians(longitude),
+                                       find_sphere_coordinates(latitude, longitude)[0], radius, time_window, exclude)
+
+    def query_radius_point(self, latitude, longitude, point, radius, time_window, exclude):
+        grid = self.get_grid(time_window)
+        if grid is None or radius < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        chord_radius = 2 * EARTH_RADIUS * np.sin(min(radius / (2 * EARTH_RADIUS), np.pi / 2))
+        rings = grid.get_rings(np.floor(point / self.cell_size).astype(np.int64))
+        cells = np.flatnonzero(rings <= np.ceil(chord_radius / self.cell_size))
+        if not len(cells):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        rows = grid.get_indices(cells)
+        rows = rows[rows != self.rows.get(exclude, -1)]
+        numbers, distances = self.sort_rows(latitude, longitude, rows)
+        is_within = distances <= radius
+        return numbers[is_within], distances[is_within]
+
+    def nearest(self, number, k, same_time_window=True):
+        '''
+        The k customers nearest to the customer numbered number, itself
+        excluded, of its time window unless same_time_window is False
+        '''
+        row = self.rows[number]
+        time_window = self.time_windows[row] if same_time_window else None
+        return self.query_point(self.latitudes[row], self.longitudes[row], self.points[row], k, time_window, number)
+
+    def within(self, number, radius, same_time_window=True):
+        '''
+        The customers within radius km of the customer numbered number, itself excluded
+        '''
+        row = self.rows[number]
+        time_window = self.time_windows[row] if same_time_window else None
+        return self.query_radius_point(self.latitudes[row], self.longitudes[row], self.points[row], radius, time_window, number)
+
+    def find_nearest(self, k, same_time_window=True):
+        '''
+        Rows of the k customers nearest to every customer, itself excluded,
+        nearest first, as an array of len(self) rows padded with -1. The
+        queries run cell by cell: the points of a cell share their rings,
+        so the search stops once the kth chord distance of all of them is
+        at most the ring size, as in query_point.
+        '''
+        nearest = np.full((len(self), k), -1, dtype=np.int64)
+        grids = [grid for key, grid in self.grids.items() if key is not None] if same_time_window else [self.grids[None]]
+        for grid in grids:
+            count = min(k, len(grid.indices) - 1)
+            if count <= 0:
+                continue
+            for cell in range(len(grid.cells)):
+                rows = grid.indices[grid.starts[cell]:grid.starts[cell+1]]
+                rings = grid.get_rings(grid.cells[cell])
+                order = np.argsort(rings, kind="stable")
+                rings = rings[order]
+                bounds = np.flatnonzero(np.diff(rings)) + 1
+
+                candidates = np.empty(0, dtype=np.int64)
+                chords = np.empty((len(rows), 0))
+                for cells, ring in zip(np.split(order, bounds), rings[np.concatenate(([0], bounds))].tolist()):
+                    new_rows = grid.get_indices(cells)
+                    candidates = np.concatenate((candidates, new_rows))
+                    new_chords = np.linalg.norm(self.points[rows, None] - self.points[None, new_rows], axis=2)
+                    new_chords[rows[:, None] == new_rows[None, :]] = np.inf
+                    chords = np.concatenate((chords, new_chords), axis=1)
+                    if len(candidates) > count and (np.partition(chords, count-1, axis=1)[:, count-1] <= ring * self.cell_size).all():
+                        break
+
+                distances = find_haversine_distances(self.latitudes[rows, None], self.longitudes[rows, None],
+                                                     self.latitudes[None, candidates], self.longitudes[None, candidates])
+                distances[rows[:, None] == candidates[None, :]] = np.inf
+                keys = np.broadcast_to(self.numbers[candidates], distances.shape)
+                order = np.lexsort((keys, distances), axis=-1)[:, :count]
+                nearest[rows, :count] = candidates[order]
+        return nearest
+
+    def find_candidate_lists(self, k, size):
+        '''
+        Same relation as find_candidate_lists, from the k nearest customers
+        of find_nearest instead of the distance matrix, size being its
+        number of rows
+        '''
+        candidate_lists = CandidateLists(self.numbers, size)
+        for source, targets in zip(self.numbers.tolist(), self.find_nearest(k).tolist()):
+            for target in targets:
+                if target < 0:
+                    break
+                candidate_lists.add(source, int(self.numbers[target]))
+                candidate_lists.add(int(self.numbers[target]), source)
+        return candidate_lists
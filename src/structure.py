@@ -1,29 +1,56 @@
 import os
 import sys
+import copy
+import hashlib
+from functools import cached_property
 import numpy as np
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
-from src.utils.utility import find_inventory_levels
+from src.utils.utility import simulate_inventory, find_distance_matrix, find_candidate_lists
+from src.instrumentation import get_instrumentation
+from src.spatial_index import SpatialIndex, SPATIAL_INDEX_MIN_CUSTOMERS
 
 
 class Customer:
-    def __init__(self, customer_info):
-        self.number = customer_info.name
-        self.name = customer_info.loc["Name"]
-        self.x = customer_info.loc["Latitude"]
-        self.y = customer_info.loc["Longtitude"]
-        self.capacity = customer_info.loc["Capacity"]
-        self.near_safety_level = customer_info.loc["Near safety level"]
-        self.safety_level = customer_info.loc["Safety level"]
-        self.init_quantity = customer_info.loc["Initial tank quantity"]
-        self.time_window = customer_info.loc["Time window"]
+    __slots__ = ("number", "name", "x", "y", "capacity", "near_safety_level", "safety_level",
+                 "init_quantity", "time_window", "is_serviced")
+
+    def __init__(self, number, name, x, y, capacity, near_safety_level, safety_level, init_quantity, time_window):
+        self.number = number
+        self.name = name
+        self.x = x
+        self.y = y
+        self.capacity = capacity
+        self.near_safety_level = near_safety_level
+        self.safety_level = safety_level
+        self.init_quantity = init_quantity
+        self.time_window = time_window
         self.is_serviced = False
 
+    @classmethod
+    def from_series(cls, customer_info):
+        return cls(customer_info.name,
+                   customer_info.loc["Name"],
+                   customer_info.loc["Latitude"],
+                   customer_info.loc["Longtitude"],
+                   customer_info.loc["Capacity"],
+                   customer_info.loc["Near safety level"],
+                   customer_info.loc["Safety level"],
+                   customer_info.loc["Initial tank quantity"],
+                   customer_info.loc["Time window"])
+
     def __repr__(self):
         return f"C_{self.name}"
 
+    # Customers are compared by number, so copies made by pickling stay equal
+    def __eq__(self, other):
+        return isinstance(other, Customer) and self.number == other.number
+
+    def __hash__(self):
+        return hash(self.number)
+
     def distance(self, target):    
         # Convert degrees to radians
         lat1, lon1, lat2, lon2 = map(np.radians, [self.x, self.y, target.x, target.y])
@@ -41,20 +68,240 @@ class Customer:
 
 
 class Problem:
-    def __init__(self, customers: list, forecasted_quantities, delivery_unit_cost, setup_cost_for_one_trip, vehicle_capacity):
+    '''
+    Customer attributes are kept as arrays aligned with the rows of
+    forecasted_quantities (the depot excluded), the Customer objects in
+    self.customers are views built from them on first use for routes and
+    operators.
+    '''
+    def __init__(self, customers: list, forecasted_quantities, delivery_unit_cost, setup_cost_for_one_trip, vehicle_capacity,
+                 distance_dtype=np.float64, distance_matrix_path=None):
+        depot = list(filter(lambda x: x.number == 0, customers))[0]
+        customers = list(filter(lambda x: x.number != 0, customers))
+        self.init_arrays(depot,
+                         [customer.number for customer in customers],
+                         [customer.name for customer in customers],
+                         [customer.x for customer in customers],
+                         [customer.y for customer in customers],
+                         [customer.capacity for customer in customers],
+                         [customer.near_safety_level for customer in customers],
+                         [customer.safety_level for customer in customers],
+                         [customer.init_quantity for customer in customers],
+                         [customer.time_window for customer in customers],
+                         forecasted_quantities, delivery_unit_cost, setup_cost_for_one_trip, vehicle_capacity,
+                         distance_dtype, distance_matrix_path)
+        # the given Customer objects serve as the views
+        self.customers = customers
+
+    @classmethod
+    def from_arrays(cls, numbers, names, latitudes, longitudes, capacities, near_safety_levels, safety_levels,
+                    init_quantities, time_windows, forecasted_quantities, delivery_unit_cost, setup_cost_for_one_trip,
+                    vehicle_capacity, distance_dtype=np.float64, distance_matrix_path=None):
+        '''
+        Problem from one array per customer attribute, the depot being the
+        entry numbered 0. No Customer is built but the depot.
+        '''
+        columns = [np.asarray(column) for column in
+                   (numbers, names, latitudes, longitudes, capacities, near_safety_levels, safety_levels, init_quantities, time_windows)]
+        is_depot = columns[0] == 0
+        depot = Customer(*[column[is_depot].tolist()[0] for column in columns])
+        problem = cls.__new__(cls)
+        problem.init_arrays(depot, *[column[~is_depot] for column in columns], forecasted_quantities, delivery_unit_cost,
+                            setup_cost_for_one_trip, vehicle_capacity, distance_dtype, distance_matrix_path)
+        return problem
+
+    def init_arrays(self, depot, numbers, names, latitudes, longitudes, capacities, near_safety_levels, safety_levels,
+                    init_quantities, time_windows, forecasted_quantities, delivery_unit_cost, setup_cost_for_one_trip,
+                    vehicle_capacity, distance_dtype=np.float64, distance_matrix_path=None):
         self.delivery_unit_cost = delivery_unit_cost
         self.setup_cost_for_one_trip = setup_cost_for_one_trip
         self.vehicle_capacity = vehicle_capacity
 
-        self.customers = list(filter(lambda x: x.number != 0, customers))
         self.forecasted_quantities = forecasted_quantities
         self.dilivery_quantities = np.zeros_like(forecasted_quantities)
-        self.depot: Customer = list(filter(lambda x: x.number == 0, customers))[0]
+        self.depot: Customer = depot
         self.depot.is_serviced = True
 
+        self.numbers = np.asarray(numbers, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.capacities = np.asarray(capacities)
+        self.near_safety_levels = np.asarray(near_safety_levels)
+        self.safety_levels = np.asarray(safety_levels)
+        self.init_quantities = np.asarray(init_quantities)
+        self.time_window_labels, self.time_window_codes = np.unique(
+            np.asarray(time_windows).astype(str).astype(object), return_inverse=True)
+        self.time_window_labels = self.time_window_labels.tolist()
+        self.time_window_codes = self.time_window_codes.astype(np.int8)
+
+        self.distance_matrix = self.get_distance_matrix(self.depot, self.numbers, self.latitudes, self.longitudes,
+                                                        distance_dtype, distance_matrix_path)
+        self.candidate_lists = {}
+
+    @cached_property
+    def customers(self):
+        '''
+        Customer view of every row of the attribute arrays
+        '''
+        return [Customer(number, name, x, y, capacity, near_safety_level, safety_level, init_quantity,
+                         self.time_window_labels[code])
+                for number, name, x, y, capacity, near_safety_level, safety_level, init_quantity, code in
+                zip(self.numbers.tolist(), self.names.tolist(), self.latitudes.tolist(), self.longitudes.tolist(),
+                    self.capacities.tolist(), self.near_safety_levels.tolist(), self.safety_levels.tolist(),
+                    self.init_quantities.tolist(), self.time_window_codes.tolist())]
+
+    def __getstate__(self):
+        # The customer views are rebuilt from the arrays, which pickle far more compactly
+        state = self.__dict__.copy()
+        state.pop("customers", None)
+        state.pop("spatial_index", None)
+        return state
+
+    @property
+    def time_windows(self):
+        return np.array(self.time_window_labels, dtype=object)[self.time_window_codes]
+
+    @cached_property
+    def window_masks(self):
+        '''
+        Time window of every customer number as a bit mask, 0 for the depot
+        '''
+        window_masks = np.zeros(len(self.distance_matrix), dtype=np.int64)
+        window_masks[self.numbers] = np.left_shift(1, self.time_window_codes.astype(np.int64))
+        return window_masks
+
+    @cached_property
+    def spatial_index(self):
+        '''
+        Nearest customer and radius queries, by time window, built once
+        per problem and shared by its copies, see SpatialIndex
+        '''
+        return SpatialIndex(self.numbers, self.latitudes, self.longitudes, self.time_windows)
+
     def __repr__(self):
         return f"Vehicle capacity: {self.vehicle_capacity}\n"
 
+    def __deepcopy__(self, memo):
+        # The distance matrix is read-only, every copy of the problem shares it
+        get_instrumentation().count("problem_deepcopies")
+        new_problem = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new_problem
+        memo[id(self.distance_matrix)] = self.distance_matrix
+        for key, value in self.__dict__.items():
+            setattr(new_problem, key, copy.deepcopy(value, memo))
+        return new_problem
+
+    def copy(self):
+        '''
+        Copy sharing everything but the delivery quantities, the only part
+        of a problem the operators change
+        '''
+        get_instrumentation().count("problem_copies")
+        new_problem = self.__class__.__new__(self.__class__)
+        new_problem.__dict__.update(self.__dict__)
+        new_problem.dilivery_quantities = self.dilivery_quantities.copy()
+        return new_problem
+
+    def get_arrays(self):
+        '''
+        Customer attributes as arrays aligned with the rows of forecasted_quantities
+        '''
+        return {
+            "numbers": self.numbers,
+            "capacities": self.capacities,
+            "safety_levels": self.safety_levels,
+            "init_quantities": self.init_quantities,
+            "is_night": self.time_windows == 'night',
+            "forecasted_quantities": np.asarray(self.forecasted_quantities),
+            "distance_matrix": np.asarray(self.distance_matrix),
+            "latitudes": self.latitudes,
+            "longitudes": self.longitudes,
+            "angles": np.arctan2(self.latitudes - self.depot.x, self.longitudes - self.depot.y),
+        }
+
+    def get_candidate_lists(self, k):
+        '''
+        Granular neighbourhood of every customer, see find_candidate_lists,
+        from the spatial index on large problems
+        '''
+        if k not in self.candidate_lists:
+            if len(self.numbers) >= SPATIAL_INDEX_MIN_CUSTOMERS:
+                self.candidate_lists[k] = self.spatial_index.find_candidate_lists(k, len(self.distance_matrix))
+            else:
+                self.candidate_lists[k] = find_candidate_lists(self.distance_matrix, self.numbers, self.time_window_codes, k)
+        return self.candidate_lists[k]
+
+    def get_t_dilivery_quantities(self, t):
+        return tuple(self.dilivery_quantities[:, t])
+
+    @staticmethod
+    def get_distance_matrix(depot, numbers, latitudes, longitudes, dtype=np.float64, path=None):
+        '''
+        Build the distance matrix indexed by customer number, or memory-map
+        it from path when it has been saved there before for the same
+        coordinates, which are saved next to it (see get_coordinates_path)
+        '''
+        coordinates = Problem.get_coordinates(depot, numbers, latitudes, longitudes)
+        size = len(coordinates)
+
+        matrix_path = Problem.get_matrix_path(path) if path is not None else None
+        if path is not None and os.path.exists(matrix_path) and os.path.exists(Problem.get_coordinates_path(path)):
+            distance_matrix = np.load(matrix_path, mmap_mode='r')
+            if (distance_matrix.shape == (size, size) and distance_matrix.dtype == np.dtype(dtype)
+                    and np.array_equal(np.load(Problem.get_coordinates_path(path)), coordinates)):
+                return distance_matrix
+
+        distance_matrix = find_distance_matrix(coordinates[:, 0], coordinates[:, 1], dtype)
+        distance_matrix.setflags(write=False)
+
+        if path is not None:
+            Problem.write_distance_matrix(path, distance_matrix, coordinates)
+        return distance_matrix
+
+    @staticmethod
+    def get_matrix_path(path):
+        '''
+        File a distance matrix saved at path is in, np.save adding the
+        extension to a path without it
+        '''
+        return path if str(path).endswith(".npy") else f"{path}.npy"
+
+    @staticmethod
+    def get_coordinates_path(path):
+        '''
+        File of the latitude and longitude of every customer number a
+        distance matrix saved at path was built from
+        '''
+        return f"{Problem.get_matrix_path(path)[:-len('.npy')]}.coordinates.npy"
+
+    @staticmethod
+    def get_coordinates(depot, numbers, latitudes, longitudes):
+        '''
+        Latitude and longitude of every customer number, depot included
+        '''
+        size = max(numbers.max(initial=0), depot.number) + 1
+        coordinates = np.zeros((size, 2))
+        coordinates[numbers, 0] = latitudes
+        coordinates[numbers, 1] = longitudes
+        coordinates[depot.number] = depot.x, depot.y
+        return coordinates
+
+    @staticmethod
+    def write_distance_matrix(path, distance_matrix, coordinates):
+        '''
+        Save the matrix and its coordinates to new files moved over the old
+        ones, so problems still mapping the old matrix keep their distances
+        '''
+        for target, array in ((Problem.get_matrix_path(path), distance_matrix), (Problem.get_coordinates_path(path), coordinates)):
+            with open(f"{target}.tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(f"{target}.tmp", target)
+
+    def save_distance_matrix(self, path):
+        self.write_distance_matrix(path, self.distance_matrix,
+                                   self.get_coordinates(self.depot, self.numbers, self.latitudes, self.longitudes))
+
     def obj_func(self, solution):
         return sum(map(lambda routes: sum([route.total_distance for route in routes]), solution))
 
@@ -67,25 +314,110 @@ class Problem:
     
     @property
     def inventory_levels(self):
-        return find_inventory_levels(self.customers,
-                                     self.forecasted_quantities,
-                                     self.dilivery_quantities)
+        running_levels = simulate_inventory(self.init_quantities, 100 / self.capacities,
+                                            np.asarray(self.forecasted_quantities), self.dilivery_quantities)
+        inventory_levels = np.zeros_like(self.forecasted_quantities)
+        inventory_levels[:] = np.round(running_levels)
+        return inventory_levels
 
 class Route:
-    def __init__(self, problem: Problem, customers: list, t_dilivery_quantities: list):
-        self.problem: Problem = problem
-        self._customers: list = [self.problem.depot, *customers, self.problem.depot]
-        self.t_dilivery_quantities: list = t_dilivery_quantities
+    '''
+    Immutable route of one period. Its distance, load, time windows and
+    feasibility are computed once at construction, an edited route is a new
+    Route (see with_customers and with_order).
+    '''
+    def __init__(self, problem: Problem, customers: list, t_dilivery_quantities: list, _metadata=None):
+        stops = (problem.depot, *customers, problem.depot)
+        numbers = tuple(customer.number for customer in stops)
+        prefix_distance = [0, *np.cumsum(problem.distance_matrix[numbers[:-1], numbers[1:]], dtype=np.float64).tolist()]
+        if _metadata is None:
+            total_quantity = 0
+            for number in numbers[1:-1]:
+                total_quantity += t_dilivery_quantities[number-1]
+            time_windows = frozenset(customer.time_window for customer in customers)
+            _metadata = (total_quantity, time_windows,
+                         len(time_windows) <= 1 and total_quantity <= problem.vehicle_capacity)
+        total_quantity, time_windows, is_feasible = _metadata
+
+        # set through __dict__ as __setattr__ refuses every change
+        self.__dict__.update(
+            problem=problem,
+            _customers=stops,
+            t_dilivery_quantities=t_dilivery_quantities,
+            numbers=numbers,
+            prefix_distance=prefix_distance,
+            total_distance=prefix_distance[-1],
+            total_quantity=total_quantity,
+            time_windows=time_windows,
+            is_feasible=is_feasible,
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Route is immutable, cannot set {name}")
 
     def __repr__(self):
         return " ".join(str(customer.number) for customer in self._customers)
 
+    def with_customers(self, customers: list):
+        '''
+        Route of the same period visiting customers
+        '''
+        return Route(self.problem, customers, self.t_dilivery_quantities)
+
+    def with_order(self, order, t_dilivery_quantities=None):
+        '''
+        Route visiting the same customers in the given order of their
+        positions. Its load, time windows and feasibility are kept unless
+        other delivery quantities are given.
+        '''
+        customers = [self._customers[i+1] for i in order]
+        if t_dilivery_quantities is not None and t_dilivery_quantities != self.t_dilivery_quantities:
+            return Route(self.problem, customers, t_dilivery_quantities)
+        return Route(self.problem, customers, self.t_dilivery_quantities,
+                     (self.total_quantity, self.time_windows, self.is_feasible))
+
+    @property
+    def edge_distances(self):
+        numbers = self.numbers
+        return self.problem.distance_matrix[numbers[:-1], numbers[1:]].tolist()
+
+    @cached_property
+    def prefix_quantity(self):
+        '''
+        Quantity delivered up to every stop of the route, in visiting order
+        '''
+        prefix_quantity = [0]
+        for number in self.numbers[1:-1]:
+            prefix_quantity.append(prefix_quantity[-1] + self.t_dilivery_quantities[number-1])
+        prefix_quantity.append(prefix_quantity[-1])
+        return prefix_quantity
+
+    @cached_property
+    def index_array(self):
+        '''
+        Customer numbers of the route, depots included, for the batch move kernels
+        '''
+        return np.array(self.numbers, dtype=np.intp)
+
+    @cached_property
+    def window_masks(self):
+        '''
+        Time window masks of the customers, see Problem.window_masks
+        '''
+        return self.problem.window_masks[self.index_array[1:-1]]
+
+    @cached_property
+    def fingerprint(self):
+        '''
+        Digest of the customer sequence and the quantities delivered to those customers
+        '''
+        quantities = np.array([self.t_dilivery_quantities[number-1] for number in self.numbers[1:-1]], dtype=np.float64)
+        return hashlib.blake2b(self.index_array.tobytes() + quantities.tobytes(), digest_size=16).digest()
+
     @property
     def canonical_view(self):
-        distance = 0
         result = [0, 0.0]
-        for source, target in zip(self._customers, self._customers[1:]):
-            distance += source.distance(target)
+        for target, distance in zip(self._customers[1:], self.prefix_distance[1:]):
             result.append(target.number)
             result.append(distance)
 
@@ -93,42 +425,9 @@ class Route:
 
     @property
     def customers(self):
-        return self._customers[1:-1]
-
-    @property
-    def total_distance(self):
-        '''
-        Find the total distance in a route
-        '''
-        total_distance = 0
-        for source, target in zip(self._customers, self._customers[1:]):
-            total_distance += source.distance(target)
-        return total_distance
-    
-    @property
-    def total_quantity(self):
-        '''
-        Find the total dilivery quantity in a route
-        '''
-        total_quantity = 0
-        for customer in self.customers:
-            total_quantity += self.t_dilivery_quantities[customer.number-1]
-        return total_quantity
+        return list(self._customers[1:-1])
 
     @property
     def edges(self):
         return list(zip(self._customers, self._customers[1:]))
 
-    @property
-    def is_feasible(self):
-        capacity = self.problem.vehicle_capacity
-        is_feasible = True
-        for source, target in zip(self.customers, self.customers[1:]):
-            if source.time_window != target.time_window:
-                is_feasible = False
-                break
-
-        if self.total_quantity > capacity:
-            is_feasible = False
-
-        return is_feasible
@@ -0,0 +1,44 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+
+def generate_instance(num_customers=16, duration=15, night_ratio=0.25, capacities=(10000, 18000, 20000, 27000),
+                      capacity_weights=None, seed=0, depot=(10.85, 106.81), radius=0.5, start_date=datetime.date(2024, 3, 1)):
+    '''
+    Synthetic (customers_df, forecasted_quantity_df) in the schema read by
+    FormatParser. Customers are scattered around the depot, night_ratio of
+    them receive at night, tank sizes are drawn from capacities with
+    capacity_weights and daily demand is a noisy share of the tank size.
+    '''
+    rng = np.random.default_rng(seed)
+    if capacity_weights is not None:
+        capacity_weights = np.asarray(capacity_weights, dtype=np.float64)
+        capacity_weights = capacity_weights / capacity_weights.sum()
+
+    angles = rng.uniform(0, 2*np.pi, num_customers)
+    distances = radius * np.sqrt(rng.uniform(0, 1, num_customers))
+    customer_capacities = rng.choice(capacities, num_customers, p=capacity_weights)
+    time_windows = np.where(rng.uniform(0, 1, num_customers) < night_ratio, "night", "day")
+
+    customers_df = pd.DataFrame({
+        "Name": ["DEPOT", *[f"CUSTOMER {i}" for i in range(1, num_customers+1)]],
+        "Latitude": np.round([depot[0], *(depot[0] + distances*np.sin(angles))], 4),
+        "Longtitude": np.round([depot[1], *(depot[1] + distances*np.cos(angles))], 4),
+        "Capacity": [0, *customer_capacities],
+        "Near safety level": [0, *[25]*num_customers],
+        "Safety level": [0, *[10]*num_customers],
+        "Initial tank quantity": [0, *rng.integers(20, 95, num_customers)],
+        "Time window": ["0", *time_windows],
+    })
+
+    # average consumption of 2 to 10 percent of the tank per day
+    daily_share = rng.uniform(0.02, 0.10, num_customers)
+    noise = rng.lognormal(0, 0.3, (duration, num_customers))
+    forecasted_quantities = np.round(customer_capacities * daily_share * noise).astype(np.int64)
+
+    dates = [start_date + datetime.timedelta(days=t) for t in range(duration)]
+    forecasted_quantity_df = pd.DataFrame(forecasted_quantities, columns=customers_df["Name"][1:].tolist())
+    forecasted_quantity_df.insert(0, "Date", [f"{date.month}/{date.day}/{date.year}" for date in dates])
+
+    return customers_df, forecasted_quantity_df
@@ -0,0 +1,145 @@
+'''
+Batch scoring of local search moves over integer route arrays.
+
+Routes are arrays of customer numbers with the depot at both ends (as
+Route.numbers), their prefix distances and quantities, and the time windows
+of their customers as bit masks, one bit per time window. Every kernel
+scores all the moves of one kind between two routes in one call. The
+arithmetic follows the scalar deltas of move_evaluation term by term, so
+both give the same results.
+
+The kernels are compiled with numba when it is installed and otherwise
+run as vectorized NumPy.
+'''
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = "numba" if numba is not None else "numpy"
+
+
+def is_uniform(masks):
+    '''
+    Whether each time window mask holds at most one time window
+    '''
+    return (masks & (masks - 1)) == 0
+
+
+def window_prefix(masks):
+    '''
+    Time window masks of customers[:i] for every i, customers being
+    the stops between the depots
+    '''
+    prefix = np.zeros(len(masks) + 1, dtype=np.int64)
+    if len(masks):
+        prefix[1:] = np.bitwise_or.accumulate(masks)
+    return prefix
+
+
+def window_suffix(masks):
+    '''
+    Time window masks of customers[i:] for every i
+    '''
+    suffix = np.zeros(len(masks) + 1, dtype=np.int64)
+    if len(masks):
+        suffix[:-1] = np.bitwise_or.accumulate(masks[::-1])[::-1]
+    return suffix
+
+
+def segment_windows(masks, length):
+    '''
+    Time window masks of customers[i:i+length] for every i
+    '''
+    segments = masks[:len(masks) - length + 1].copy()
+    for offset in range(1, length):
+        segments |= masks[offset:len(masks) - length + 1 + offset]
+    return segments
+
+
+def _or_opt_deltas_numpy(distance_matrix, numbers):
+    '''
+    Distance delta of reversing customers[i:j+1] for every i < j, inf elsewhere
+    '''
+    m = len(numbers) - 2
+    i, j = np.triu_indices(m, 1)
+    prev, first, last, following = numbers[i], numbers[i+1], numbers[j+1], numbers[j+2]
+    deltas = np.full((m, m), np.inf)
+    deltas[i, j] = distance_matrix[prev, last] + distance_matrix[first, following] \
+                 - distance_matrix[prev, first] - distance_matrix[last, following]
+    return deltas
+
+
+def _or_opt_deltas_loop(distance_matrix, numbers):
+    m = len(numbers) - 2
+    deltas = np.full((m, m), np.inf)
+    for i in range(m):
+        for j in range(i+1, m):
+            prev, first, last, following = numbers[i], numbers[i+1], numbers[j+1], numbers[j+2]
+            deltas[i, j] = distance_matrix[prev, last] + distance_matrix[first, following] \
+                         - distance_matrix[prev, first] - distance_matrix[last, following]
+    return deltas
+
+
+def _relocate_deltas_numpy(distance_matrix, numbers, target_last, depot, length):
+    '''
+    Distance delta of moving customers[i:i+length] to the end of a route
+    whose last stop before depot is target_last, for every i
+    '''
+    idx = np.arange(len(numbers) - 2 - length + 1)
+    prev, first, last, following = numbers[idx], numbers[idx+1], numbers[idx+length], numbers[idx+length+1]
+    return distance_matrix[target_last, first] + distance_matrix[last, depot] - distance_matrix[target_last, depot] \
+         + distance_matrix[prev, following] - distance_matrix[prev, first] - distance_matrix[last, following]
+
+
+def _relocate_deltas_loop(distance_matrix, numbers, target_last, depot, length):
+    count = len(numbers) - 2 - length + 1
+    deltas = np.empty(max(count, 0))
+    for i in range(count):
+        prev, first, last, following = numbers[i], numbers[i+1], numbers[i+length], numbers[i+length+1]
+        deltas[i] = distance_matrix[target_last, first] + distance_matrix[last, depot] - distance_matrix[target_last, depot] \
+                  + distance_matrix[prev, following] - distance_matrix[prev, first] - distance_matrix[last, following]
+    return deltas
+
+
+def _cross_exchange_deltas_numpy(distance_matrix, numbers_a, inner_a, numbers_b, inner_b, length_a, length_b):
+    '''
+    Distance delta of exchanging customers_a[i:i+length_a] with
+    customers_b[j:j+length_b] for every (i, j), inner_a and inner_b being
+    the distances travelled inside those segments
+    '''
+    i = np.arange(len(inner_a))[:, None]
+    j = np.arange(len(inner_b))[None, :]
+    a_prev, a_first, a_last, a_next = numbers_a[i], numbers_a[i+1], numbers_a[i+length_a], numbers_a[i+length_a+1]
+    b_prev, b_first, b_last, b_next = numbers_b[j], numbers_b[j+1], numbers_b[j+length_b], numbers_b[j+length_b+1]
+    inner_a, inner_b = inner_a[:, None], inner_b[None, :]
+    return distance_matrix[a_prev, b_first] + inner_b + distance_matrix[b_last, a_next] \
+         - distance_matrix[a_prev, a_first] - inner_a - distance_matrix[a_last, a_next] \
+         + distance_matrix[b_prev, a_first] + inner_a + distance_matrix[a_last, b_next] \
+         - distance_matrix[b_prev, b_first] - inner_b - distance_matrix[b_last, b_next]
+
+
+def _cross_exchange_deltas_loop(distance_matrix, numbers_a, inner_a, numbers_b, inner_b, length_a, length_b):
+    deltas = np.empty((len(inner_a), len(inner_b)))
+    for i in range(len(inner_a)):
+        a_prev, a_first, a_last, a_next = numbers_a[i], numbers_a[i+1], numbers_a[i+length_a], numbers_a[i+length_a+1]
+        for j in range(len(inner_b)):
+            b_prev, b_first, b_last, b_next = numbers_b[j], numbers_b[j+1], numbers_b[j+length_b], numbers_b[j+length_b+1]
+            deltas[i, j] = distance_matrix[a_prev, b_first] + inner_b[j] + distance_matrix[b_last, a_next] \
+                         - distance_matrix[a_prev, a_first] - inner_a[i] - distance_matrix[a_last, a_next] \
+                         + distance_matrix[b_prev, a_first] + inner_a[i] + distance_matrix[a_last, b_next] \
+                         - distance_matrix[b_prev, b_first] - inner_b[j] - distance_matrix[b_last, b_next]
+    return deltas
+
+
+# The loops are the compiled kernels, the vectorized versions their NumPy fallback
+if numba is not None:
+    or_opt_deltas = numba.njit(cache=True)(_or_opt_deltas_loop)
+    relocate_deltas = numba.njit(cache=True)(_relocate_deltas_loop)
+    cross_exchange_deltas = numba.njit(cache=True)(_cross_exchange_deltas_loop)
+else:
+    or_opt_deltas = _or_opt_deltas_numpy
+    relocate_deltas = _relocate_deltas_numpy
+    cross_exchange_deltas = _cross_exchange_deltas_numpy
@@ -0,0 +1,195 @@
+from collections import namedtuple
+import numpy as np
+
+from src.utils.kernels import or_opt_deltas, relocate_deltas, cross_exchange_deltas, \
+    is_uniform, window_prefix, window_suffix, segment_windows
+
+
+MoveDelta = namedtuple("MoveDelta", ["distance", "load_a", "load_b", "is_feasible"])
+
+
+def segment_time_windows(route, i, j):
+    '''
+    Time windows of route.customers[i:j]
+    '''
+    if i >= j:
+        return frozenset()
+    if len(route.time_windows) <= 1:
+        return route.time_windows
+    return frozenset(customer.time_window for customer in route.customers[i:j])
+
+
+def segment_quantity(route, i, j):
+    return route.prefix_quantity[j] - route.prefix_quantity[i]
+
+
+def segment_distance(route, i, j):
+    '''
+    Distance travelled inside route.customers[i:j]
+    '''
+    if i >= j:
+        return 0
+    return route.prefix_distance[j] - route.prefix_distance[i+1]
+
+
+def delta_relocate(source, target, i, length=1):
+    '''
+    Move source.customers[i:i+length] to the end of target, load_a refers
+    to source and load_b to target
+    '''
+    distance_matrix = source.problem.distance_matrix
+    numbers = source.numbers
+    prev, first, last, following = numbers[i], numbers[i+1], numbers[i+length], numbers[i+length+1]
+    target_last, depot = target.numbers[-2], target.numbers[-1]
+    distance = distance_matrix[target_last, first] + distance_matrix[last, depot] - distance_matrix[target_last, depot] \
+             + distance_matrix[prev, following] - distance_matrix[prev, first] - distance_matrix[last, following]
+
+    quantity = segment_quantity(source, i, i+length)
+    capacity = source.problem.vehicle_capacity
+    source_windows = segment_time_windows(source, 0, i) | segment_time_windows(source, i+length, len(source.numbers)-2)
+    target_windows = target.time_windows | segment_time_windows(source, i, i+length)
+    is_feasible = len(source_windows) <= 1 and len(target_windows) <= 1 \
+                  and source.total_quantity - quantity <= capacity \
+                  and target.total_quantity + quantity <= capacity
+
+    return MoveDelta(distance, -quantity, quantity, is_feasible)
+
+
+def delta_cross_exchange(route_a, route_b, i, j, length_a=1, length_b=1):
+    '''
+    Exchange route_a.customers[i:i+length_a] with route_b.customers[j:j+length_b]
+    '''
+    distance_matrix = route_a.problem.distance_matrix
+    numbers_a, numbers_b = route_a.numbers, route_b.numbers
+    a_prev, a_first, a_last, a_next = numbers_a[i], numbers_a[i+1], numbers_a[i+length_a], numbers_a[i+length_a+1]
+    b_prev, b_first, b_last, b_next = numbers_b[j], numbers_b[j+1], numbers_b[j+length_b], numbers_b[j+length_b+1]
+    inner_a = segment_distance(route_a, i, i+length_a)
+    inner_b = segment_distance(route_b, j, j+length_b)
+
+    distance = distance_matrix[a_prev, b_first] + inner_b + distance_matrix[b_last, a_next] \
+             - distance_matrix[a_prev, a_first] - inner_a - distance_matrix[a_last, a_next] \
+             + distance_matrix[b_prev, a_first] + inner_a + distance_matrix[a_last, b_next] \
+             - distance_matrix[b_prev, b_first] - inner_b - distance_matrix[b_last, b_next]
+
+    quantity_a = segment_quantity(route_a, i, i+length_a)
+    quantity_b = segment_quantity(route_b, j, j+length_b)
+    capacity = route_a.problem.vehicle_capacity
+    windows_a = segment_time_windows(route_a, 0, i) | segment_time_windows(route_a, i+length_a, len(numbers_a)-2) \
+              | segment_time_windows(route_b, j, j+length_b)
+    windows_b = segment_time_windows(route_b, 0, j) | segment_time_windows(route_b, j+length_b, len(numbers_b)-2) \
+              | segment_time_windows(route_a, i, i+length_a)
+    is_feasible = len(windows_a) <= 1 and len(windows_b) <= 1 \
+                  and route_a.total_quantity - quantity_a + quantity_b <= capacity \
+                  and route_b.total_quantity - quantity_b + quantity_a <= capacity
+
+    return MoveDelta(distance, quantity_b - quantity_a, quantity_a - quantity_b, is_feasible)
+
+
+def is_candidate_edge(candidate_lists, source, target):
+    return target in candidate_lists.get(source, ())
+
+
+def is_granular_relocate(candidate_lists, source, target, i, length=1):
+    numbers = source.numbers
+    return is_candidate_edge(candidate_lists, target.numbers[-2], numbers[i+1]) \
+        or is_candidate_edge(candidate_lists, numbers[i], numbers[i+length+1])
+
+
+def is_granular_cross_exchange(candidate_lists, route_a, route_b, i, j, length_a=1, length_b=1):
+    numbers_a, numbers_b = route_a.numbers, route_b.numbers
+    return is_candidate_edge(candidate_lists, numbers_a[i], numbers_b[j+1]) \
+        or is_candidate_edge(candidate_lists, numbers_b[j+length_b], numbers_a[i+length_a+1]) \
+        or is_candidate_edge(candidate_lists, numbers_b[j], numbers_a[i+1]) \
+        or is_candidate_edge(candidate_lists, numbers_a[i+length_a], numbers_b[j+length_b+1])
+
+
+def get_candidate_matrix(candidate_lists, size):
+    '''
+    Boolean matrix of a candidate relation, built when candidate_lists is a plain dict
+    '''
+    matrix = getattr(candidate_lists, "matrix", None)
+    if matrix is None:
+        matrix = np.zeros((size, size), dtype=bool)
+        for source, targets in candidate_lists.items():
+            matrix[source, list(targets)] = True
+    return matrix
+
+
+def batch_or_opt_numbers(distance_matrix, numbers, candidate_matrix=None):
+    '''
+    Distance delta of reversing customers[i:j+1] (2-opt) for every i < j,
+    numbers being the customer numbers of a route, depots included. inf
+    where i >= j or where the move puts no customer next to a candidate.
+    '''
+    deltas = or_opt_deltas(distance_matrix, numbers)
+    if candidate_matrix is not None:
+        m = len(numbers) - 2
+        i, j = np.arange(m)[:, None], np.arange(m)[None, :]
+        is_granular = candidate_matrix[numbers[i], numbers[j+1]] | candidate_matrix[numbers[i+1], numbers[j+2]]
+        deltas[~is_granular] = np.inf
+    return deltas
+
+
+def batch_relocate(source, target, length=1, candidate_matrix=None):
+    '''
+    Distance deltas and feasibility of delta_relocate for every i, a move
+    that is not granular is infeasible
+    '''
+    problem = source.problem
+    numbers = source.index_array
+    masks = source.window_masks
+    count = len(numbers) - 2 - length + 1
+    if count <= 0:
+        return np.empty(0), np.empty(0, dtype=bool)
+    i = np.arange(count)
+
+    deltas = relocate_deltas(problem.distance_matrix, numbers, target.index_array[-2], target.index_array[-1], length)
+    prefix_quantity = np.array(source.prefix_quantity)
+    quantities = prefix_quantity[i+length] - prefix_quantity[i]
+    capacity = problem.vehicle_capacity
+    source_windows = window_prefix(masks)[i] | window_suffix(masks)[i+length]
+    target_windows = np.bitwise_or.reduce(target.window_masks, initial=0) | segment_windows(masks, length)
+    is_feasible = is_uniform(source_windows) & is_uniform(target_windows) \
+                  & (source.total_quantity - quantities <= capacity) \
+                  & (target.total_quantity + quantities <= capacity)
+    if candidate_matrix is not None:
+        is_feasible &= candidate_matrix[target.index_array[-2], numbers[i+1]] | candidate_matrix[numbers[i], numbers[i+length+1]]
+    return deltas, is_feasible
+
+
+def batch_cross_exchange(route_a, route_b, length_a=1, length_b=1, candidate_matrix=None):
+    '''
+    Distance deltas and feasibility of delta_cross_exchange for every
+    (i, j), a move that is not granular is infeasible
+    '''
+    problem = route_a.problem
+    distance_matrix = problem.distance_matrix
+    numbers_a, numbers_b = route_a.index_array, route_b.index_array
+    masks_a, masks_b = route_a.window_masks, route_b.window_masks
+    if len(masks_a) < length_a or len(masks_b) < length_b:
+        return np.empty((max(len(masks_a) - length_a + 1, 0), max(len(masks_b) - length_b + 1, 0))), \
+               np.empty((max(len(masks_a) - length_a + 1, 0), max(len(masks_b) - length_b + 1, 0)), dtype=bool)
+    i = np.arange(len(numbers_a) - 2 - length_a + 1)[:, None]
+    j = np.arange(len(numbers_b) - 2 - length_b + 1)[None, :]
+
+    # inner distances in the matrix dtype, as the scalar deltas would add them
+    prefix_distance_a, prefix_distance_b = np.array(route_a.prefix_distance), np.array(route_b.prefix_distance)
+    inner_a = (prefix_distance_a[i[:, 0]+length_a] - prefix_distance_a[i[:, 0]+1]).astype(distance_matrix.dtype)
+    inner_b = (prefix_distance_b[j[0]+length_b] - prefix_distance_b[j[0]+1]).astype(distance_matrix.dtype)
+    deltas = cross_exchange_deltas(distance_matrix, numbers_a, inner_a, numbers_b, inner_b, length_a, length_b)
+
+    prefix_quantity_a, prefix_quantity_b = np.array(route_a.prefix_quantity), np.array(route_b.prefix_quantity)
+    quantity_a = prefix_quantity_a[i+length_a] - prefix_quantity_a[i]
+    quantity_b = prefix_quantity_b[j+length_b] - prefix_quantity_b[j]
+    capacity = problem.vehicle_capacity
+    windows_a = window_prefix(masks_a)[i] | window_suffix(masks_a)[i+length_a] | segment_windows(masks_b, length_b)[j]
+    windows_b = window_prefix(masks_b)[j] | window_suffix(masks_b)[j+length_b] | segment_windows(masks_a, length_a)[i]
+    is_feasible = is_uniform(windows_a) & is_uniform(windows_b) \
+                  & (route_a.total_quantity - quantity_a + quantity_b <= capacity) \
+                  & (route_b.total_quantity - quantity_b + quantity_a <= capacity)
+    if candidate_matrix is not None:
+        is_feasible &= candidate_matrix[numbers_a[i], numbers_b[j+1]] \
+                     | candidate_matrix[numbers_b[j+length_b], numbers_a[i+length_a+1]] \
+                     | candidate_matrix[numbers_b[j], numbers_a[i+1]] \
+                     | candidate_matrix[numbers_a[i+length_a], numbers_b[j+length_b+1]]
+    return deltas, is_feasible
@@ -1,35 +1,156 @@
+import heapq
 import numpy as np
 
+from src.instrumentation import get_instrumentation
+
+
+EARTH_RADIUS = 6371     # km
+# Nearest customers whose savings find_savings_pairs keeps, on days with more customers
+SAVINGS_NEIGHBOURS = 50
+
+
+def find_distance_matrix(latitudes, longitudes, dtype=np.float64):
+    '''
+    Find the haversine distance between every pair of locations
+    '''
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return find_haversine_distances(lat[:, None], lon[:, None], lat[None, :], lon[None, :]).astype(dtype, copy=False)
+
+
+def find_haversine_distances(lat1, lon1, lat2, lon2):
+    '''
+    Haversine distance in km between broadcast arrays of locations, in radians
+    '''
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) * np.sin(dlat / 2) + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) * np.sin(dlon / 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS * c
+
+
+class CandidateLists(dict):
+    '''
+    Set of candidate customer numbers for every customer number, the same
+    relation is kept as a boolean matrix for the batch move kernels
+    '''
+    def __init__(self, numbers, size):
+        super().__init__((int(number), set()) for number in numbers)
+        self.matrix = np.zeros((size, size), dtype=bool)
+
+    def add(self, source, target):
+        self[source].add(target)
+        self.matrix[source, target] = True
+
+
+def find_candidate_lists(distance_matrix, numbers, time_windows, k):
+    '''
+    For every customer number, its k nearest customers in the same time
+    window and every customer that has it among its own k nearest
+    '''
+    numbers = np.asarray(numbers)
+    time_windows = np.asarray(time_windows)
+    candidate_lists = CandidateLists(numbers, len(distance_matrix))
+    for time_window in np.unique(time_windows):
+        group = numbers[time_windows == time_window]
+        if len(group) < 2:
+            continue
+        distances = np.array(distance_matrix[np.ix_(group, group)], dtype=np.float64)
+        np.fill_diagonal(distances, np.inf)
+        nearest = np.argpartition(distances, min(k, len(group)-1) - 1, axis=1)[:, :min(k, len(group)-1)]
+        for source, targets in zip(group.tolist(), group[nearest].tolist()):
+            for target in targets:
+                candidate_lists.add(source, target)
+                candidate_lists.add(target, source)
+
+    return candidate_lists
+
+
+def get_inventory_parameters(customers):
+    '''
+    Initial tank level (percent) and percent per unit of quantity of every customer
+    '''
+    init_quantities = np.array([customer.init_quantity for customer in customers])
+    scaling_factors = 100 / np.array([customer.capacity for customer in customers])
+    return init_quantities, scaling_factors
+
+
+def simulate_inventory(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities, running_levels=None, t=0):
+    '''
+    Unrounded tank level of every customer at the end of every day. Given the
+    running_levels of an earlier simulation, only days t onward are recomputed
+    in place, which is all that a change of the deliveries on day t affects.
+    '''
+    if running_levels is None:
+        running_levels = np.empty(np.shape(forecasted_quantities))
+        t = 0
+
+    # Adding the negated steps matches the day-by-day subtraction exactly
+    steps = -scaling_factors[:, None]*(forecasted_quantities[:, t:] - dilivery_quantities[:, t:])
+    steps[:, 0] += init_quantities if t == 0 else running_levels[:, t-1]
+    np.cumsum(steps, axis=1, out=running_levels[:, t:])
+
+    return running_levels
+
 
 def find_inventory_levels(customers, forecasted_quantities, dilivery_quantities):
+    init_quantities, scaling_factors = get_inventory_parameters(customers)
+    running_levels = simulate_inventory(init_quantities, scaling_factors, np.asarray(forecasted_quantities), np.asarray(dilivery_quantities))
+
     inventory_levels = np.zeros_like(forecasted_quantities)
-    for i in range(len(forecasted_quantities)):
-        current_value = customers[i].init_quantity
-        scaling_factor = 100 / customers[i].capacity
-        for t in range(len(forecasted_quantities[0])):
-            current_value -= scaling_factor*(forecasted_quantities[i][t] - dilivery_quantities[i][t])
-            inventory_levels[i][t] = round(current_value,0)
+    inventory_levels[:] = np.round(running_levels)
+    return inventory_levels
 
+
+def update_inventory_levels(inventory_levels, running_levels, init_quantities, scaling_factors,
+                            forecasted_quantities, dilivery_quantities, t):
+    '''
+    Bring inventory_levels and running_levels up to date after the deliveries
+    on day t changed, only columns t onward are touched
+    '''
+    simulate_inventory(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities, running_levels, t)
+    inventory_levels[:, t:] = np.round(running_levels[:, t:])
     return inventory_levels
 
 
-def check_urgency_degree(customer, inventory_levels, t, i, look_ahead):
-    urgency_degree = False
-    for time in range(t+1, t+look_ahead):
-        if time > len(inventory_levels[i])-1:
-            break
-        levels_condition = inventory_levels[i][time] - customer.safety_level
-        # print("check_urgency_degree: ", time, levels_condition)
-        if levels_condition < 0:
-            urgency_degree = True
+def find_inventory_violations(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities, safety_levels):
+    '''
+    Inventory feasibility of every customer on every day at once: whether
+    the end-of-day tank level falls below the safety level, and whether a
+    delivery overfills the tank (level of the day before plus the delivery
+    above 100 percent)
+    '''
+    running_levels = simulate_inventory(init_quantities, scaling_factors, forecasted_quantities, dilivery_quantities)
+    is_below_safety = running_levels < safety_levels[:, None]
+    is_overfilled = find_filled_levels(init_quantities, scaling_factors, dilivery_quantities, running_levels) > 100
+    return is_below_safety, is_overfilled
+
+
+def find_filled_levels(init_quantities, scaling_factors, dilivery_quantities, running_levels):
+    '''
+    Tank level right after every day's delivery, before that day's consumption
+    '''
+    previous_levels = np.concatenate((np.asarray(init_quantities, dtype=np.float64)[:, None], running_levels[:, :-1]), axis=1)
+    return previous_levels + scaling_factors[:, None]*dilivery_quantities
 
-    return urgency_degree
+
+def check_urgency_degree(inventory_levels, safety_levels, t, look_ahead):
+    '''
+    Customers whose tank falls below its safety level within the look ahead days after t
+    '''
+    return (inventory_levels[:, t+1:t+look_ahead] < safety_levels[:, None]).any(axis=1)
 
 
 def nearest_neighbor_insertion_heuristic(customers_in_route, t_dilivery_quantities, vehicle_capacity):
+    '''
+    Split the customer numbers in customers_in_route into routes, in list
+    order, whenever the vehicle capacity fills
+    '''
     customer_dilivery = []
     for customer in customers_in_route:
-        customer_dilivery.append([customer, t_dilivery_quantities[customer.number-1]])
+        customer_dilivery.append([customer, t_dilivery_quantities[customer-1]])
 
     routes = []
     current_subroute = []
@@ -49,15 +170,114 @@ def nearest_neighbor_insertion_heuristic(customers_in_route, t_dilivery_quantiti
     return routes
 
 
+def find_savings_pairs(distance_matrix, numbers, depot=0, neighbours=SAVINGS_NEIGHBOURS, nearest=None):
+    '''
+    Clarke-Wright savings d(depot, i) + d(depot, j) - d(i, j) of the pairs
+    of customer numbers, as a heap of (-saving, i, j) holding the positive
+    savings. Past neighbours customers only the pairs of every customer
+    with its neighbours nearest are kept, nearest giving their positions
+    in numbers (-1 padded, see SpatialIndex.find_nearest) if known.
+    '''
+    numbers = np.asarray(numbers, dtype=np.intp)
+    depot_distances = distance_matrix[depot, numbers]
+    if len(numbers) - 1 > neighbours:
+        if nearest is None:
+            distances = distance_matrix[np.ix_(numbers, numbers)].astype(np.float64)
+            np.fill_diagonal(distances, np.inf)
+            nearest = np.argpartition(distances, neighbours, axis=1)[:, :neighbours]
+        i = np.repeat(np.arange(len(numbers)), nearest.shape[1])
+        j = nearest.ravel()
+        i, j = i[j >= 0], j[j >= 0]
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        pairs = np.unique(i * len(numbers) + j)
+        i, j = pairs // len(numbers), pairs % len(numbers)
+    else:
+        i, j = np.triu_indices(len(numbers), 1)
+    pair_savings = depot_distances[i] + depot_distances[j] - distance_matrix[numbers[i], numbers[j]]
+    is_positive = pair_savings > 0
+    heap = list(zip((-pair_savings[is_positive]).tolist(), numbers[i[is_positive]].tolist(), numbers[j[is_positive]].tolist()))
+    heapq.heapify(heap)
+    return heap
+
+
+def savings_heuristic(customers_in_route, t_dilivery_quantities, vehicle_capacity, distance_matrix, depot=0, nearest=None):
+    '''
+    Split the customer numbers in customers_in_route into routes with the
+    parallel Clarke-Wright savings algorithm: start from one route per
+    customer and merge two routes end to end by decreasing saving while
+    the vehicle capacity allows it, nearest as in find_savings_pairs
+    '''
+    routes = {customer: [customer] for customer in customers_in_route}
+    route_of = {customer: customer for customer in customers_in_route}
+    loads = {customer: t_dilivery_quantities[customer-1] for customer in customers_in_route}
+    if len(customers_in_route) < 2:
+        return list(routes.values())
+
+    heap = find_savings_pairs(distance_matrix, customers_in_route, depot, nearest=nearest)
+    while heap:
+        _, i, j = heapq.heappop(heap)
+        route_i, route_j = route_of[i], route_of[j]
+        if route_i == route_j or loads[route_i] + loads[route_j] > vehicle_capacity:
+            continue
+        a, b = routes[route_i], routes[route_j]
+        # i and j must both be at an end of their route, the merged route joins them
+        if i not in (a[0], a[-1]) or j not in (b[0], b[-1]):
+            continue
+        if a[-1] != i:
+            a.reverse()
+        if b[0] != j:
+            b.reverse()
+        a.extend(b)
+        loads[route_i] += loads.pop(route_j)
+        del routes[route_j]
+        for customer in b:
+            route_of[customer] = route_i
+
+    return list(routes.values())
+
+
+def sweep_heuristic(customers_in_route, t_dilivery_quantities, vehicle_capacity, angles):
+    '''
+    Split the customer numbers in customers_in_route into routes by sweeping
+    around the depot, angles[number-1] being the polar angle of a customer
+    seen from the depot. The sweep starts after the widest angular gap and
+    opens a new route whenever the vehicle capacity fills.
+    '''
+    if not customers_in_route:
+        return []
+    customer_angles = np.asarray(angles)[np.asarray(customers_in_route) - 1]
+    order = np.argsort(customer_angles, kind="stable")
+    sorted_angles = customer_angles[order]
+    gaps = np.diff(sorted_angles, append=sorted_angles[0] + 2*np.pi)
+    start = (int(np.argmax(gaps)) + 1) % len(order)
+    swept = [customers_in_route[k] for k in np.roll(order, -start).tolist()]
+    return nearest_neighbor_insertion_heuristic(swept, t_dilivery_quantities, vehicle_capacity)
+
+
 def zeros_like_list(input_list):
     return [[0 for _ in range(len(sublist2))] for sublist2 in input_list]
 
 
-def find_logistic_ratio(problem, solution):
-    setup_cost = 0
-    delivery_cost = 0
-    total_delivered_quantity = 0
+def get_route_distance(distance_matrix, customers_in_route):
+    '''
+    Total distance of a depot-to-depot route over the customer numbers in customers_in_route
+    '''
+    numbers = [0, *customers_in_route, 0]
+    total_distance = 0
+    for edge_distance in distance_matrix[numbers[:-1], numbers[1:]].tolist():
+        total_distance += edge_distance
+    return total_distance
 
+
+def get_route_quantity(t_dilivery_quantities, customers_in_route):
+    total_quantity = 0
+    for customer in customers_in_route:
+        total_quantity += t_dilivery_quantities[customer-1]
+    return total_quantity
+
+
+def find_logistic_ratio(problem, solution):
+    get_instrumentation().count("find_logistic_ratio")
     delivered_quantity_list = zeros_like_list(solution)
     distance_list = zeros_like_list(solution)
 
@@ -65,10 +285,24 @@ def find_logistic_ratio(problem, solution):
         for j, route in enumerate(solution[i]):
             delivered_quantity_list[i][j] = route.total_quantity
             distance_list[i][j] = route.total_distance
-            
-            number_vehicle = np.ceil(route.total_quantity/problem.vehicle_capacity)
-            setup_cost += number_vehicle*problem.setup_cost_for_one_trip
-            delivery_cost += number_vehicle*route.total_distance*problem.delivery_unit_cost
+
+    return find_routes_logistic_ratio(delivered_quantity_list, distance_list, problem.vehicle_capacity,
+                                      problem.setup_cost_for_one_trip, problem.delivery_unit_cost)
+
+
+def find_routes_logistic_ratio(delivered_quantity_list, distance_list, vehicle_capacity, setup_cost_for_one_trip, delivery_unit_cost):
+    '''
+    Logistic ratio from the quantity and distance of every route of every period
+    '''
+    setup_cost = 0
+    delivery_cost = 0
+    total_delivered_quantity = 0
+
+    for quantities, distances in zip(delivered_quantity_list, distance_list):
+        for total_quantity, total_distance in zip(quantities, distances):
+            number_vehicle = np.ceil(total_quantity/vehicle_capacity)
+            setup_cost += number_vehicle*setup_cost_for_one_trip
+            delivery_cost += number_vehicle*total_distance*delivery_unit_cost
 
     total_delivered_quantity = sum(sum(sublist) for sublist in delivered_quantity_list if sublist) 
     logistic_ratio = (setup_cost + delivery_cost)/total_delivered_quantity
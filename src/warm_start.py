@@ -0,0 +1,44 @@
+import os
+import sys
+import numpy as np
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from src.structure import Problem
+from src.solution_state import copy_solution
+from src.construction_heuristic import ConstructionHeuristic, IteratedLocalSearch
+
+
+def find_first_changed_day(forecasted_quantities, new_forecasted_quantities):
+    '''
+    First day (column) on which the two forecasts differ, None when they are equal
+    '''
+    changed_days = np.flatnonzero((np.asarray(forecasted_quantities) != np.asarray(new_forecasted_quantities)).any(axis=0))
+    return int(changed_days[0]) if len(changed_days) else None
+
+
+class WarmStartIteratedLocalSearch(IteratedLocalSearch):
+    '''
+    Re-optimize a previous (problem, solution) after a forecast update.
+    Periods before the first changed day minus look_back are frozen: they
+    keep their routes and deliveries. The construction rebuilds the
+    deliveries from that day on against the new forecast, and local search
+    and perturbation only work on those periods, so the work grows with the
+    part of the horizon that changed.
+    '''
+    def __init__(self, problem: Problem, solution: list, forecasted_quantities, construction_workers=1,
+                 seed=None, granularity=None, look_back=1):
+        self.changed_day = find_first_changed_day(problem.forecasted_quantities, forecasted_quantities)
+        new_problem = problem.copy()
+        new_problem.forecasted_quantities = np.asarray(forecasted_quantities)
+
+        if self.changed_day is None:
+            self.start = new_problem.duration
+            initial_solution = copy_solution(solution)
+        else:
+            self.start = max(0, self.changed_day - look_back)
+            initial_solution = ConstructionHeuristic(new_problem, construction_workers, solution, self.start).get_solution()
+
+        super().__init__(new_problem, initial_solution=initial_solution, seed=seed, granularity=granularity,
+                         periods=range(self.start, new_problem.duration))